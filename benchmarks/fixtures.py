@@ -0,0 +1,296 @@
+"""
+Synthetic input files with the same layout the parsers in src/data expect.
+
+Every builder is deterministic for a given seed so that benchmark runs are
+comparable with the stored baselines.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime
+from xml.sax.saxutils import escape
+import numpy as np
+import polars as pl
+import threading
+import hashlib
+import zipfile
+import csv
+
+MONTHS = ["Enero", "Febrero", "Marzo",
+          "Abril", "Mayo", "Junio", "Julio",
+          "Agosto", "Septiembre", "Octubre",
+          "Noviembre", "Diciembre"]
+
+CONSUMER_MONTHS = ["ene", "feb", "mar", "abr", "may", "jun",
+                   "jul", "ago", "sep", "oct", "nov", "dic"]
+
+INDICATORS = ["Indice de Actividad Economica",
+              "Encuesta de Grupo Trabajador Ajustada Estacionalmente",
+              "Encuesta de Grupo Trabajador",
+              "Encuesta de Establecimientos Ajustados Estacionalmente",
+              "Encuesta de Establecimientos",
+              "Indicadores de Turismo",
+              "Indicadores de Construccion",
+              "Indicadores de Ingresos Netos",
+              "Indicadores de Energia Electrica",
+              "Indicadores de Comercio Exterior",
+              "Indicadores de Quiebras",
+              "Indicadores de Ventas al Detalle a Precios Corrientes",
+              "Precios Promedios Mensuales de Gasolina al Detal en Puerto Rico",
+              "Indice de Precios al Consumidor 2006 = 100",
+              "Indicadores de Transportacion",
+              "Indices Coincidentes de Actividad Economica",
+              "Encuesta de Establecimientos Manufactura"]
+
+AWARD_FIELDS = ["internal_id", "Award ID", "Recipient Name", "Start Date", "End Date",
+                "Award Amount", "Awarding Agency", "Awarding Sub Agency",
+                "Funding Agency", "Funding Sub Agency", "Award Type",
+                "generated_internal_id"]
+
+
+def max_sheet_years() -> int:
+    # process_sheet keeps years in [2000, next year] and halves wider sheets
+    return min(datetime.now().year + 2 - 2000, datetime.now().year - 1997)
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _cell(row: int, col: int, value) -> str:
+    ref = f"{_column_letter(col)}{row + 1}"
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return f'<c r="{ref}" t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+    return f'<c r="{ref}"><v>{value!r}</v></c>'
+
+
+def write_xlsx(file_path: str, sheets: dict) -> None:
+    """
+    Writes a minimal xlsx workbook.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the workbook
+    sheets : dict
+        Mapping of sheet name to a list of rows, each row a list of cell values
+    """
+    names = list(sheets)
+    with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as book:
+        book.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + "".join(f'<Override PartName="/xl/worksheets/sheet{i + 1}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                      for i in range(len(names)))
+            + '</Types>'))
+        book.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'))
+        book.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + "".join(f'<sheet name="{escape(name)}" sheetId="{i + 1}" r:id="rId{i + 1}"/>' for i, name in enumerate(names))
+            + '</sheets></workbook>'))
+        book.writestr("xl/_rels/workbook.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + "".join(f'<Relationship Id="rId{i + 1}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{i + 1}.xml"/>'
+                      for i in range(len(names)))
+            + '</Relationships>'))
+        for i, name in enumerate(names):
+            rows = "".join(f'<row r="{r + 1}">' + "".join(_cell(r, c, v) for c, v in enumerate(row)) + '</row>'
+                           for r, row in enumerate(sheets[name]))
+            book.writestr(f"xl/worksheets/sheet{i + 1}.xml", (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                f'<sheetData>{rows}</sheetData></worksheet>'))
+
+
+def indicator_sheet(title: str, years: list, rng: np.random.Generator) -> list:
+    """
+    Rows of a `Meses`/year grid sheet as found in economic_indicators.xlsx.
+    """
+    rows = [["Junta de Planificacion", title],
+            ["Serie mensual", None],
+            [None, "Meses", *years]]
+    for month in MONTHS:
+        values = []
+        for value in rng.uniform(0, 5000, len(years)):
+            draw = rng.random()
+            if draw < 0.05:
+                values.append("n/d")
+            elif draw < 0.1:
+                values.append(f"$({value:,.2f})")
+            else:
+                values.append(float(round(value, 2)))
+        rows.append([None, month, *values])
+    rows.append(["Fuente: Junta de Planificacion", None])
+    return rows
+
+
+def write_indicators_workbook(file_path: str, years: int = 25, sheets: int = 17, seed: int = 0) -> None:
+    """
+    Writes a synthetic economic_indicators.xlsx with `sheets` indicator sheets
+    starting at sheet 3, each with `years` year columns.
+    """
+    rng = np.random.default_rng(seed)
+    years = list(range(2000, 2000 + min(years, max_sheet_years())))
+    book = {"Indice": [["Indicadores Economicos"]], "Notas": [["Notas"]]}
+    for i in range(sheets):
+        title = INDICATORS[i] if i < len(INDICATORS) else f"Indicador Sintetico {i}"
+        book[f"Hoja {i + 3}"] = indicator_sheet(title, years, rng)
+    write_xlsx(file_path, book)
+
+
+def wide_panel(years: int = 25, seed: int = 0) -> pl.DataFrame:
+    """
+    A cleaned sheet as passed to DataIndex.process_panel: a `Meses` column and
+    one string column per year.
+    """
+    rng = np.random.default_rng(seed)
+    data = {"Meses": [month.lower() for month in MONTHS]}
+    for year in range(2000, 2000 + years):
+        data[str(year)] = [f"{value:,.2f}" if value > 100 else "n/d" for value in rng.uniform(0, 5000, 12)]
+    return pl.DataFrame(data)
+
+
+def consumer_sheet(years: int = 25, seed: int = 0) -> pl.DataFrame:
+    """
+    The consumer.xls sheet as read by pl.read_excel: a row with the component
+    names, a units row, one row per month labelled like `ene-05` and a footnote.
+    """
+    from src.dao.consumer_table import ConsumerTable
+
+    rng = np.random.default_rng(seed)
+    components = [name for name in ConsumerTable.model_fields if name not in ("id", "date")]
+    header = ["Descripción", *[name.replace("_", " ").title() for name in components]]
+    rows = [header, ["", *["Indice" for _ in components]]]
+    for year in range(years):
+        for month in CONSUMER_MONTHS:
+            label = f"{month}-{(1980 + year) % 100:02d}"
+            rows.append([label, *[f"{value:.3f}" for value in rng.uniform(80, 140, len(components))]])
+    rows.append(["Fuente: Departamento del Trabajo", *["" for _ in components]])
+    columns = ["Indice de Precios al Consumidor", *[f"__UNNAMED__{i}" for i in range(1, len(header))]]
+    return pl.DataFrame(rows, schema=columns, orient="row")
+
+
+def write_awards_csv(file_path: str, rows: int = 100000, seed: int = 0) -> None:
+    """
+    Writes a synthetic USAspending prime award CSV as saved by awards_pull.
+    """
+    rng = np.random.default_rng(seed)
+    agencies = [f"Department of Agency {i}" for i in range(20)]
+    types = ["DEFINITIVE CONTRACT", "PURCHASE ORDER", "BPA CALL", "DELIVERY ORDER"]
+    with open(file_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(AWARD_FIELDS)
+        start = rng.integers(0, 5800, rows)
+        length = rng.integers(1, 1500, rows)
+        amount = rng.lognormal(10, 2, rows).round(2)
+        agency = rng.integers(0, len(agencies), rows)
+        kind = rng.integers(0, len(types), rows)
+        for i in range(rows):
+            start_date = np.datetime64("2007-10-01") + start[i]
+            writer.writerow([
+                i, f"AWD{i:09d}", f"Recipient {i % 5000}",
+                str(start_date), str(start_date + length[i]),
+                amount[i] if i % 97 else "",
+                agencies[agency[i]], f"Sub Agency {agency[i]}-{i % 7}",
+                agencies[agency[i]], f"Sub Agency {agency[i]}-{i % 7}",
+                types[kind[i]], f"CONT_AWD_{i:09d}"])
+
+
+def death_exposure(ages: int = 16, years: int = 30, seed: int = 0):
+    """
+    Deaths and exposure matrices with age groups as the index and years as columns.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    columns = [str(year) for year in range(1990, 1990 + years)]
+    index = pd.Index([f"{5 * i}-{5 * i + 4}" for i in range(ages)], name="age_group")
+    exposure = rng.uniform(1e4, 1e5, (ages, years))
+    rates = np.exp(-8 + 0.3 * np.arange(ages))[:, None] * np.exp(-0.01 * np.arange(years))[None, :]
+    deaths = exposure * rates * rng.uniform(0.9, 1.1, (ages, years))
+    return pd.DataFrame(deaths, index=index, columns=columns), pd.DataFrame(exposure, index=index, columns=columns)
+
+
+class FileServer:
+    """
+    Local stand-in for the raw data sources, used to exercise DataPull.download
+    without network access. It serves `body` on every GET or POST with an ETag
+    and a Last-Modified date. It answers If-None-Match with 304, honors
+    Range/If-Range with 206, and drops the connection after `cut` bytes of
+    the next response when `cut` is set. Every request is recorded in
+    `requests` as (method, status, headers).
+
+        with FileServer(body) as server:
+            DataPull().download(server.url, file_path)
+    """
+    def __init__(self, body: bytes):
+        self.body = body
+        self.cut = 0
+        self.requests = []
+
+    @property
+    def etag(self) -> str:
+        return '"%s"' % hashlib.sha256(self.body).hexdigest()[:32]
+
+    def __enter__(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def respond(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                body, start = server.body, 0
+                if self.headers.get("If-None-Match") == server.etag:
+                    status = 304
+                elif self.headers.get("Range") and self.headers.get("If-Range") == server.etag:
+                    status = 206
+                    start = int(self.headers["Range"].split("=")[1].split("-")[0])
+                else:
+                    status = 200
+                server.requests.append((self.command, status, dict(self.headers)))
+                self.send_response(status)
+                if status == 304:
+                    self.end_headers()
+                    return
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                self.send_header("ETag", server.etag)
+                self.send_header("Last-Modified", "Wed, 01 Oct 2025 00:00:00 GMT")
+                self.send_header("Content-Length", str(len(body) - start))
+                self.end_headers()
+                if server.cut:
+                    # Simulate an interrupted transfer
+                    self.wfile.write(body[start:start + server.cut])
+                    self.wfile.flush()
+                    server.cut = 0
+                    self.close_connection = True
+                    return
+                self.wfile.write(body[start:])
+
+            do_GET = do_POST = respond
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/file"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
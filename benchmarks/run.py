@@ -0,0 +1,228 @@
+"""
+Offline benchmark suite for the processing pipeline.
+
+Builds synthetic fixtures in a temporary directory, times every stage and
+compares the results with the stored baselines. Run from the repository root:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --years 25 --sheets 17 --awards 500000
+    python -m benchmarks.run --save   # overwrite the stored baselines
+"""
+from tempfile import TemporaryDirectory
+import tracemalloc
+import argparse
+import random
+import json
+import time
+import sys
+import os
+
+from . import fixtures
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+
+def measure(stage: str, fn, rows: int, repeat: int = 3, setup=None) -> dict:
+    """
+    Times a stage and measures its peak memory.
+
+    The best of `repeat` runs is reported as wall time. `setup`, if given, runs
+    untimed before every run. Peak memory is measured on
+    a separate run under tracemalloc, which tracks Python and numpy allocations but
+    not the ones made inside the Polars or SQLite native code.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    seconds = min(timings)
+    return {
+        "stage": stage,
+        "seconds": seconds,
+        "rows": rows,
+        "rows_per_s": rows / seconds if seconds else float("inf"),
+        "peak_mb": peak / 2**20,
+    }
+
+
+def clear_awards(inserter) -> None:
+    """
+    Empties the awards tables, so every insert run loads new awards instead of
+    skipping the ones stored by the previous run.
+    """
+    from sqlmodel import delete
+    from dao.award_rollups import ROLLUPS
+    from dao.awards_table import AwardTable
+
+    with inserter.engine.begin() as connection:
+        for model in [AwardTable, *ROLLUPS]:
+            connection.execute(delete(model))
+
+
+def reset_download(file_path: str) -> None:
+    """
+    Removes a downloaded file, its partial body and their metadata.
+    """
+    for path in (file_path, f"{file_path}.meta.json", f"{file_path}.part", f"{file_path}.part.meta.json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def interrupt_download(puller, server, file_path: str) -> None:
+    """
+    Leaves a partial download of the served file behind: the transfer is cut
+    half way and only `<file_path>.part` is kept.
+    """
+    reset_download(file_path)
+    server.cut = len(server.body) // 2
+    try:
+        puller.download(server.url, file_path)
+    except Exception:
+        pass
+    assert not os.path.exists(file_path) and os.path.getsize(f"{file_path}.part") == len(server.body) // 2
+
+
+def check_download(puller, server, file_path: str, status: int) -> None:
+    """
+    Downloads the served file and checks the request was answered with `status`,
+    and that the file matches the served body afterwards.
+    """
+    downloaded = puller.download(server.url, file_path)
+    assert server.requests[-1][1] == status, server.requests[-1]
+    assert downloaded == (status != 304)
+    with open(file_path, "rb") as file:
+        assert file.read() == server.body
+
+
+def run(years: int, sheets: int, awards: int, simulations: int, repeat: int) -> list:
+    from src.data.data_process import DataIndex
+    from src.data.data_pull import DataPull
+    from src.data.lee_carter import mortModel, mortBatch
+    from src.data.monte_carlo import monteCarlo
+
+    sys.path.append(os.path.abspath("src"))
+    from src.data.awards_process import AwardDataCleanerInserter
+
+    results = []
+    with TemporaryDirectory() as tmp:
+        workbook = f"{tmp}/economic_indicators.xlsx"
+        fixtures.write_indicators_workbook(workbook, years, sheets)
+        sheet_years = min(years, fixtures.max_sheet_years())
+        index = DataIndex.__new__(DataIndex)
+        sheet_ids = list(range(3, 3 + sheets))
+
+        results.append(measure("process_sheet", lambda: index.process_sheet(workbook, 3),
+                               12 * sheet_years, repeat))
+        panel = fixtures.wide_panel(years)
+        results.append(measure("process_panel", lambda: index.process_panel(panel, "value"),
+                               12 * years, repeat))
+        results.append(measure("process_workbook", lambda: index.process_workbook(workbook, sheet_ids),
+                               12 * sheet_years * sheets, repeat))
+        panels = index.process_workbook(workbook, sheet_ids)
+        results.append(measure("join_panels", lambda: index.join_panels(panels),
+                               12 * sheet_years * sheets, repeat))
+        consumer = fixtures.consumer_sheet(years)
+        results.append(measure("clean_consumer", lambda: index.clean_consumer(consumer),
+                               12 * years, repeat))
+
+        # Conditional and resumed downloads against a local stand-in for the sources
+        body = random.Random(0).randbytes(4 * 2**20)
+        raw_file = f"{tmp}/download.bin"
+        with fixtures.FileServer(body) as server:
+            puller = DataPull()
+            results.append(measure("download", lambda: check_download(puller, server, raw_file, 200),
+                                   len(body), repeat, setup=lambda: reset_download(raw_file)))
+            results.append(measure("download_not_modified", lambda: check_download(puller, server, raw_file, 304),
+                                   len(body), repeat))
+            results.append(measure("download_resume", lambda: check_download(puller, server, raw_file, 206),
+                                   len(body) // 2, repeat, setup=lambda: interrupt_download(puller, server, raw_file)))
+
+        csv_file = f"{tmp}/prime_award_results.csv"
+        fixtures.write_awards_csv(csv_file, awards)
+        inserter = AwardDataCleanerInserter(tmp, f"sqlite:///{tmp}/awards.sqlite")
+        results.append(measure("awards_clean_data", lambda: inserter.clean_data(csv_file),
+                               awards, repeat))
+        cleaned = inserter.clean_data(csv_file)
+        results.append(measure("awards_insert_into_db", lambda: inserter.insert_into_db(cleaned),
+                               len(cleaned), repeat, setup=lambda: clear_awards(inserter)))
+
+        deaths, exposure = fixtures.death_exposure()
+        results.append(measure("mortModel", lambda: mortModel(deaths, exposure).mortality_rate([-1.0] * 50),
+                               deaths.size, repeat))
+        populations = [fixtures.death_exposure(seed=seed) for seed in range(48)]
+        results.append(measure("mortBatch", lambda: mortBatch([d for d, _ in populations], [e for _, e in populations]).fit(),
+                               deaths.size * len(populations), repeat))
+
+        kt = [0.5 - 0.01 * i for i in range(50)]
+        model = monteCarlo(simulations, seed=0)
+        results.append(measure("monteCarlo_simulate_normal",
+                               lambda: model.simulate_normal(range(2020, 2070), kt, .8, -0.3236444, 0.2996471),
+                               simulations * len(kt), repeat))
+        draws = model.simulate_normal(range(2020, 2070), kt, .8, -0.3236444, 0.2996471)
+        results.append(measure("monteCarlo_percentiles", lambda: model.percentiles(draws),
+                               draws.size, repeat))
+    return results
+
+
+def compare(results: list, baselines: dict, tolerance: float) -> list:
+    """
+    Returns the stages that are slower than `tolerance` times their baseline.
+    Stages run at a different scale than their baseline are not compared.
+    """
+    regressions = []
+    for result in results:
+        baseline = baselines.get(result["stage"])
+        if baseline is None or baseline["rows"] != result["rows"]:
+            result["baseline"] = None
+            continue
+        result["baseline"] = baseline["seconds"]
+        if result["seconds"] > baseline["seconds"] * tolerance:
+            regressions.append(result["stage"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the jp-index pipeline on synthetic data")
+    parser.add_argument("--years", type=int, default=25, help="year columns per sheet and years of consumer data")
+    parser.add_argument("--sheets", type=int, default=17, help="indicator sheets in the workbook")
+    parser.add_argument("--awards", type=int, default=100000, help="rows in the awards CSV")
+    parser.add_argument("--simulations", type=int, default=100000, help="Monte Carlo simulations per year")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown over the baseline")
+    parser.add_argument("--baselines", default=BASELINES, help="path of the baselines file")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    args = parser.parse_args()
+
+    results = run(args.years, args.sheets, args.awards, args.simulations, args.repeat)
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as file:
+            baselines = json.load(file)
+    regressions = compare(results, baselines, args.tolerance)
+
+    print(f"{'stage':<28}{'seconds':>10}{'baseline':>10}{'rows/s':>14}{'peak MB':>10}")
+    for result in results:
+        baseline = f"{result['baseline']:.4f}" if result["baseline"] is not None else "-"
+        flag = "  \033[0;31mREGRESSION\033[0m" if result["stage"] in regressions else ""
+        print(f"{result['stage']:<28}{result['seconds']:>10.4f}{baseline:>10}"
+              f"{result['rows_per_s']:>14,.0f}{result['peak_mb']:>10.1f}{flag}")
+
+    if args.save:
+        with open(args.baselines, "w") as file:
+            json.dump({r["stage"]: {k: r[k] for k in ("seconds", "rows", "peak_mb")} for r in results}, file, indent=2)
+        print(f"\033[0;32mSUCCESS: \033[0mBaselines saved to {args.baselines}")
+    elif regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
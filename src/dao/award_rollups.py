@@ -0,0 +1,28 @@
+from sqlmodel import Field, SQLModel, UniqueConstraint
+from typing import Optional
+
+class AwardAgencyMonthTable(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("awarding_agency", "awarding_sub_agency", "month"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    awarding_agency: Optional[str]
+    awarding_sub_agency: Optional[str]
+    month: Optional[str]  # YYYY-MM of the award start date
+    award_count: int = 0
+    award_amount: float = 0.0
+
+class AwardTypeYearTable(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("award_type", "fiscal_year"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    award_type: Optional[str]
+    fiscal_year: Optional[int]  # Fiscal year of the award start date, from Oct 1
+    award_count: int = 0
+    award_amount: float = 0.0
+
+# Rollup tables and the columns they group AwardTable rows by
+ROLLUPS = {
+    AwardAgencyMonthTable: ["awarding_agency", "awarding_sub_agency", "month"],
+    AwardTypeYearTable: ["award_type", "fiscal_year"],
+}
+
+def create_award_rollups(engine):
+    SQLModel.metadata.create_all(engine, tables=[model.__table__ for model in ROLLUPS])
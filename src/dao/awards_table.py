@@ -1,3 +1,4 @@
+import datetime
 from typing import Optional
 
 from sqlmodel import Field, SQLModel
@@ -5,10 +6,12 @@ from sqlmodel import Field, SQLModel
 
 class AwardTable(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    award_id: str
+    # Unique id of the award in USAspending, loading the same award twice leaves a single row
+    generated_internal_id: Optional[str] = Field(default=None, unique=True)
+    award_id: str = Field(index=True)
     recipient_name: Optional[str]
-    start_date: Optional[str]
-    end_date: Optional[str]
+    start_date: Optional[datetime.date] = Field(default=None, index=True)
+    end_date: Optional[datetime.date]
     award_amount: Optional[float]
     awarding_agency: Optional[str]
     awarding_sub_agency: Optional[str]
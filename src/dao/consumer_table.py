@@ -1,9 +1,10 @@
 from sqlmodel import Field, SQLModel
 from typing import Optional
+import datetime
 
 class ConsumerTable(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    date: str
+    date: datetime.date = Field(index=True, unique=True)
     ropa: float
     ropa_de_hombres: float
     ropa_de_ninos: float
@@ -0,0 +1,34 @@
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, UniqueConstraint
+from sqlalchemy.types import SmallInteger
+from sqlmodel import SQLModel
+
+def create_duckdb_table(conn, model: type[SQLModel]):
+    """
+    Creates the table of a SQLModel class in a DuckDB ibis connection. DuckDB has no
+    SQLAlchemy dialect in this project, so the DDL is built from the model columns,
+    with a sequence standing in for the auto-incrementing primary key.
+    """
+    table = model.__table__
+    if table.name in conn.list_tables():
+        return
+    columns = []
+    for column in table.columns:
+        # FLOAT and INTEGER are 32-bit in DuckDB, Polars loads the models' columns as 64-bit
+        if isinstance(column.type, SmallInteger):
+            column_type = "SMALLINT"
+        else:
+            column_type = {float: "DOUBLE", int: "BIGINT"}.get(column.type.python_type) or column.type.compile(dialect=postgresql.dialect())
+        definition = f"{column.name} {column_type}"
+        if column.primary_key:
+            conn.raw_sql(f"CREATE SEQUENCE IF NOT EXISTS {table.name}_{column.name}_seq")
+            definition += f" PRIMARY KEY DEFAULT nextval('{table.name}_{column.name}_seq')"
+        elif not column.nullable:
+            definition += " NOT NULL"
+        columns.append(definition)
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint):
+            columns.append(f"UNIQUE ({', '.join(column.name for column in constraint.columns)})")
+    conn.raw_sql(f"CREATE TABLE IF NOT EXISTS {table.name} ({', '.join(columns)})")
+    for index in table.indexes:
+        conn.raw_sql(str(CreateIndex(index, if_not_exists=True).compile(dialect=postgresql.dialect())))
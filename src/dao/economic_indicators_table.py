@@ -1,9 +1,10 @@
 from sqlmodel import Field, SQLModel
 from typing import Optional
+import datetime
 
 class IndicatorsTable(SQLModel, table=True):
     id: Optional[int] = Field(primary_key=True)
-    date: str
+    date: datetime.date = Field(index=True, unique=True)
     indice_de_actividad_economica: Optional[float] = None
     encuesta_de_grupo_trabajador_ajustada_estacionalmente: Optional[float] = None
     encuesta_de_grupo_trabajador: Optional[float] = None
@@ -0,0 +1,12 @@
+from sqlmodel import Field, SQLModel
+from typing import Optional
+
+class RefreshTable(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    table_name: str = Field(index=True, unique=True)
+    file_path: str
+    file_hash: str
+    last_date: Optional[str] = None
+
+def create_refresh_table(engine):
+    SQLModel.metadata.create_all(engine)
@@ -0,0 +1,20 @@
+from sqlmodel import Field, Index, SmallInteger, SQLModel, UniqueConstraint
+from typing import Optional
+import datetime
+
+class SeriesTable(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("dataset", "name"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    dataset: str  # e.g. 'consumer' or 'indicators'
+    name: str  # Column name of the series in the wide table
+
+class ObservationTable(SQLModel, table=True):
+    # Rows are only appended: a revised value is a new row and the latest id wins
+    __table_args__ = (Index("ix_observationtable_series_id_date", "series_id", "date"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    series_id: int = Field(sa_type=SmallInteger)
+    date: datetime.date
+    value: Optional[float]  # None when a stored value was withdrawn
+
+def create_series_tables(engine):
+    SQLModel.metadata.create_all(engine, tables=[SeriesTable.__table__, ObservationTable.__table__])
@@ -1,15 +1,118 @@
+import io
 import os
 
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import numpy as np
 import pandas as pd
-from sqlmodel import create_engine, Session, SQLModel
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Integer, String, bindparam, case, cast, inspect, or_
+from sqlmodel import create_engine, delete, func, insert, select, update, SQLModel
 from tqdm import tqdm
 
 # Añadir el directorio raíz del proyecto al sys.path
 sys.path.append(os.path.abspath("/home/jjrm/jp-index-2/src"))
 
 from dao.awards_table import AwardTable
+from dao.award_rollups import ROLLUPS, AwardAgencyMonthTable, AwardTypeYearTable
+
+try:
+    from .metrics import Event, emit, measure, stage
+except ImportError:
+    from metrics import Event, emit, measure, stage
+
+# Raw CSV headers and the AwardTable columns they map to
+COLUMN_MAP = {
+    "Award ID": "award_id",
+    "Recipient Name": "recipient_name",
+    "Start Date": "start_date",
+    "End Date": "end_date",
+    "Award Amount": "award_amount",
+    "Awarding Agency": "awarding_agency",
+    "Awarding Sub Agency": "awarding_sub_agency",
+    "Funding Agency": "funding_agency",
+    "Funding Sub Agency": "funding_sub_agency",
+    "Award Type": "award_type",
+    "generated_internal_id": "generated_internal_id",
+}
+
+# Schema of the processed Parquet files, fixed so every batch of a file matches
+PARQUET_SCHEMA = pa.schema(
+    [
+        (
+            column,
+            pa.float64() if column == "award_amount"
+            else pa.timestamp("ns") if column in ("start_date", "end_date")
+            else pa.string(),
+        )
+        for column in COLUMN_MAP.values()
+    ]
+)
+
+
+def clean_batch(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cleans a batch of raw awards rows. Every step works on whole columns, so the
+    same transforms serve a full CSV or one batch of a streamed one.
+
+    Args:
+        df (pd.DataFrame): Rows as read from the raw CSV file.
+
+    Returns:
+        pd.DataFrame: Cleaned DataFrame ready for insertion into the database.
+    """
+    # Rename columns to match database schema
+    df = df.rename(columns=COLUMN_MAP)
+
+    # Drop rows with missing critical data
+    df = df.dropna(subset=["award_id", "award_amount"])
+
+    # Convert date columns to proper datetime format
+    df["start_date"] = pd.to_datetime(df["start_date"], errors="coerce")
+    df["end_date"] = pd.to_datetime(df["end_date"], errors="coerce")
+
+    # Fill or clean up other columns as needed
+    df["award_amount"] = df["award_amount"].fillna(0)
+    return df
+
+
+def clean_to_parquet(file_path: str, output_path: str, batch_size: int) -> Event:
+    """
+    Streams a raw awards CSV file into a processed Parquet file. The CSV is read in
+    batches of `batch_size` rows and each batch is cleaned and written as its own
+    row group, so memory use does not grow with the size of the file. Runs in the
+    worker processes of `AwardDataCleanerInserter.process_and_insert`, so the
+    `award_parse` measurement is returned for the parent to emit instead of
+    being sent to the sinks from the worker.
+
+    Args:
+        file_path (str): Path to the raw CSV file.
+        output_path (str): Path of the Parquet file to write.
+        batch_size (int): Number of rows read and cleaned at a time.
+
+    Returns:
+        Event: The `award_parse` measurement, with the number of rows written.
+    """
+    rows = 0
+    batches = pd.read_csv(
+        file_path,
+        usecols=lambda column: column in COLUMN_MAP,
+        dtype={source: str for source, column in COLUMN_MAP.items() if column != "award_amount"},
+        chunksize=batch_size,
+    )
+    with measure("award_parse", file=os.path.basename(file_path)) as event:
+        with pq.ParquetWriter(f"{output_path}.tmp", PARQUET_SCHEMA, compression="zstd") as writer:
+            for batch in batches:
+                batch = clean_batch(batch).reindex(columns=PARQUET_SCHEMA.names)
+                writer.write_table(pa.Table.from_pandas(batch, schema=PARQUET_SCHEMA, preserve_index=False))
+                rows += len(batch)
+        os.replace(f"{output_path}.tmp", output_path)
+        event.rows = rows
+        event.bytes = os.path.getsize(file_path)
+    return event
 
 
 class AwardDataCleanerInserter:
@@ -18,11 +121,13 @@ class AwardDataCleanerInserter:
         data_dir: str = "data",
         database_url: str = "sqlite:///db.sqlite",
         debug: bool = False,
+        chunk_size: int = 50000,
     ):
         self.data_dir = data_dir
         self.database_url = database_url
         self.engine = create_engine(database_url)
         self.debug = debug
+        self.chunk_size = chunk_size
         self._prepare_directories()
         self._create_table()
 
@@ -30,14 +135,30 @@ class AwardDataCleanerInserter:
         os.makedirs(f"{self.data_dir}/processed", exist_ok=True)
 
     def _create_table(self):
+        existing = inspect(self.engine).get_table_names()
         SQLModel.metadata.create_all(self.engine)
+        # Backfill rollup tables added to a database that already holds awards
+        if any(model.__tablename__ not in existing for model in ROLLUPS):
+            self.rebuild_rollups()
+
+    def process_and_insert(self, streaming: bool = False, workers: int = None):
+        """
+        Cleans every raw awards CSV file and inserts it into the database.
 
-    def process_and_insert(self):
+        Args:
+            streaming (bool): Whether to stream the files in batches of `chunk_size`
+                rows through a process pool and write Parquet instead of CSV, which
+                keeps memory flat regardless of the size of the files.
+            workers (int): Number of processes used in streaming mode. Defaults to
+                the number of CPUs.
+        """
         raw_files = [
             f"{self.data_dir}/raw/{file}"
             for file in os.listdir(f"{self.data_dir}/raw")
             if file.endswith(".csv")
         ]
+        if streaming:
+            return self._process_streaming(raw_files, workers)
 
         for raw_file in raw_files:
             try:
@@ -62,6 +183,70 @@ class AwardDataCleanerInserter:
                     f"\033[0;31mERROR: \033[0mFailed to process {raw_file}. Reason: {e}"
                 )
 
+    def _process_streaming(self, raw_files: list, workers: int = None):
+        """
+        Cleans the raw files into Parquet in a process pool and inserts each one
+        from this process as soon as it is ready, row group by row group in one
+        transaction per file.
+
+        Args:
+            raw_files (list): Paths of the raw CSV files.
+            workers (int): Number of processes. Defaults to the number of CPUs.
+        """
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for raw_file in raw_files:
+                print(f"\033[0;34mProcessing: {raw_file}\033[0m")
+                processed_file = raw_file.replace("/raw/", "/processed/").removesuffix(".csv") + ".parquet"
+                future = executor.submit(clean_to_parquet, raw_file, processed_file, self.chunk_size)
+                futures[future] = (raw_file, processed_file)
+
+            for future in as_completed(futures):
+                raw_file, processed_file = futures[future]
+                try:
+                    emit(future.result())
+                    self.insert_parquet(processed_file)
+                    print(
+                        f"\033[0;32mSUCCESS: \033[0mData from {raw_file} inserted into the database"
+                    )
+                except Exception as e:
+                    print(
+                        f"\033[0;31mERROR: \033[0mFailed to process {raw_file}. Reason: {e}"
+                    )
+
+    def insert_parquet(self, file_path: str) -> int:
+        """
+        Inserts a processed Parquet file into the database one row group at a time,
+        in a single transaction: if any row group fails, nothing from the file is
+        stored.
+
+        Args:
+            file_path (str): Path to the processed Parquet file.
+
+        Returns:
+            int: Number of rows inserted.
+        """
+        parquet_file = pq.ParquetFile(file_path)
+        rows = 0
+        start = time.perf_counter()
+        try:
+            with self.engine.begin() as connection:
+                for index in range(parquet_file.num_row_groups):
+                    rows += self._insert_rows(connection, parquet_file.read_row_group(index).to_pandas())
+        except Exception as e:
+            print(
+                f"\033[0;31mERROR: \033[0mFailed to insert {file_path} into the database. Reason: {e}"
+            )
+            raise
+
+        elapsed = time.perf_counter() - start
+        if self.debug:
+            print(
+                f"\033[0;36mNOTICE: \033[0mInserted {rows} rows in {elapsed:.2f}s "
+                f"({rows / max(elapsed, 1e-9):,.0f} rows/s)"
+            )
+        return rows
+
     def clean_data(self, file_path: str) -> pd.DataFrame:
         """
         Cleans the raw awards data CSV file.
@@ -74,59 +259,333 @@ class AwardDataCleanerInserter:
         """
         try:
             # Read the CSV file into a DataFrame
-            df = pd.read_csv(file_path)
-
-            # Perform any necessary cleaning steps here
-            # Example: Rename columns to match database schema
-            df = df.rename(
-                columns={
-                    "Award ID": "award_id",
-                    "Recipient Name": "recipient_name",
-                    "Start Date": "start_date",
-                    "End Date": "end_date",
-                    "Award Amount": "award_amount",
-                    "Awarding Agency": "awarding_agency",
-                    "Awarding Sub Agency": "awarding_sub_agency",
-                    "Funding Agency": "funding_agency",
-                    "Funding Sub Agency": "funding_sub_agency",
-                    "Award Type": "award_type",
-                }
-            )
-
-            # Optional: Drop rows with missing critical data
-            df = df.dropna(subset=["award_id", "award_amount"])
-
-            # Convert date columns to proper datetime format
-            df["start_date"] = pd.to_datetime(df["start_date"], errors="coerce")
-            df["end_date"] = pd.to_datetime(df["end_date"], errors="coerce")
-
-            # Fill or clean up other columns as needed
-            df["award_amount"] = df["award_amount"].fillna(0)
+            with stage("award_parse", file=os.path.basename(file_path)) as event:
+                df = pd.read_csv(file_path)
+                event.rows = len(df)
+                event.bytes = os.path.getsize(file_path)
 
-            return df
+            return clean_batch(df)
         except Exception as e:
             print(f"\033[0;31mERROR: \033[0mFailed to clean {file_path}. Reason: {e}")
             raise
 
-    def insert_into_db(self, cleaned_df: pd.DataFrame):
+    def insert_into_db(self, cleaned_df: pd.DataFrame, chunk_size: int = None) -> int:
         """
-        Inserts the cleaned DataFrame into the database.
+        Inserts the cleaned DataFrame into the database in a single transaction.
+        Awards already stored, with the same USAspending `generated_internal_id`,
+        are skipped, so loading a file again is a no-op.
+
+        Rows are written in chunks: with COPY on PostgreSQL through psycopg2 and
+        with a batched executemany on any other backend or driver (e.g. SQLite,
+        psycopg 3).
 
         Args:
             cleaned_df (pd.DataFrame): Cleaned DataFrame.
+            chunk_size (int): Number of rows sent per batch. Defaults to the
+                value given to the constructor.
+
+        Returns:
+            int: Number of rows inserted.
         """
+        start = time.perf_counter()
         try:
-            with Session(self.engine) as session:
-                for _, row in tqdm(
-                    cleaned_df.iterrows(),
-                    total=cleaned_df.shape[0],
-                    desc="Inserting into DB",
-                ):
-                    award = AwardTable(**row.to_dict())
-                    session.add(award)
-                session.commit()
+            with self.engine.begin() as connection:
+                rows = self._insert_rows(connection, cleaned_df, chunk_size)
         except Exception as e:
             print(
                 f"\033[0;31mERROR: \033[0mFailed to insert data into the database. Reason: {e}"
             )
             raise
+
+        elapsed = time.perf_counter() - start
+        if self.debug:
+            print(
+                f"\033[0;36mNOTICE: \033[0mInserted {rows} rows in {elapsed:.2f}s "
+                f"({rows / max(elapsed, 1e-9):,.0f} rows/s)"
+            )
+        return rows
+
+    def _insert_rows(self, connection, cleaned_df: pd.DataFrame, chunk_size: int = None) -> int:
+        """
+        Inserts cleaned awards that are not stored yet and adds them to the rollup
+        tables, through a connection whose transaction is managed by the caller.
+
+        Args:
+            connection: Open SQLAlchemy connection inside the insert transaction.
+            cleaned_df (pd.DataFrame): Cleaned DataFrame.
+            chunk_size (int): Number of rows sent per batch. Defaults to the
+                value given to the constructor.
+
+        Returns:
+            int: Number of rows inserted.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        table = AwardTable.__table__
+        columns = [column.name for column in table.columns if column.name != "id"]
+        df = cleaned_df.reindex(columns=columns)
+
+        # Dates are stored in DATE columns
+        for column in ["start_date", "end_date"]:
+            df[column] = pd.to_datetime(df[column], errors="coerce").dt.date
+        df = df.astype(object).where(df.notna(), None)
+
+        # An award listed twice in the input is stored once, awards without an id can't be matched
+        keyed = df["generated_internal_id"].notna()
+        duplicated = keyed & df.duplicated(subset=["generated_internal_id"])
+        if duplicated.any():
+            print(
+                f"\033[0;36mNOTICE: \033[0mSkipped {duplicated.sum()} rows with a repeated generated_internal_id"
+            )
+            df = df[~duplicated]
+        if not keyed.all():
+            print(
+                f"\033[0;36mNOTICE: \033[0m{(~keyed).sum()} rows have no generated_internal_id and are inserted unchecked"
+            )
+
+        with stage("db_insert", table=table.name) as event:
+            df = self._new_awards(connection, df)
+            event.rows = len(df)
+            for offset in tqdm(
+                range(0, len(df), chunk_size),
+                total=-(-len(df) // chunk_size),
+                desc="Inserting into DB",
+            ):
+                chunk = df.iloc[offset : offset + chunk_size]
+                # cursor.copy_expert is specific to psycopg2, other drivers use executemany
+                if self.engine.dialect.name == "postgresql" and self.engine.dialect.driver == "psycopg2":
+                    self._copy_chunk(connection, table.name, columns, chunk)
+                else:
+                    connection.execute(table.insert(), chunk.to_dict("records"))
+            self._update_rollups(connection, df)
+        return len(df)
+
+    def _new_awards(self, connection, df: pd.DataFrame, batch_size: int = 5000) -> pd.DataFrame:
+        """
+        Drops the awards whose generated_internal_id is already in AwardTable.
+
+        Args:
+            connection: Open SQLAlchemy connection inside the insert transaction.
+            df (pd.DataFrame): Awards to insert, without duplicated ids.
+            batch_size (int): Number of ids looked up per query.
+
+        Returns:
+            pd.DataFrame: The awards that are not stored yet.
+        """
+        if connection.execute(select(AwardTable.id).limit(1)).first() is None:
+            return df
+        internal_ids = df["generated_internal_id"].dropna().unique().tolist()
+        existing = set()
+        for offset in range(0, len(internal_ids), batch_size):
+            existing.update(
+                connection.execute(
+                    select(AwardTable.generated_internal_id).where(
+                        AwardTable.generated_internal_id.in_(internal_ids[offset : offset + batch_size])
+                    )
+                ).scalars()
+            )
+        return df[~df["generated_internal_id"].isin(existing)]
+
+    def _copy_chunk(self, connection, table_name: str, columns: list, chunk: pd.DataFrame):
+        """
+        Streams a chunk of rows into a PostgreSQL table with COPY, through psycopg2.
+
+        Args:
+            connection: Open SQLAlchemy connection inside the insert transaction.
+            table_name (str): Name of the target table.
+            columns (list): Column names, in the order they appear in the chunk.
+            chunk (pd.DataFrame): Rows to copy.
+        """
+        buffer = io.StringIO()
+        chunk.to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+    def _rollup_keys(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds the month and fiscal year of the start date of each award, derived from
+        the dates as they are stored in AwardTable.
+
+        Args:
+            df (pd.DataFrame): Awards with `start_date` as stored in the database.
+
+        Returns:
+            pd.DataFrame: The awards with `month` and `fiscal_year` columns.
+        """
+        dates = df["start_date"].astype("string")
+        year = pd.to_numeric(dates.str.slice(0, 4), errors="coerce")
+        month = pd.to_numeric(dates.str.slice(5, 7), errors="coerce")
+        return df.assign(
+            month=dates.str.slice(0, 7),
+            fiscal_year=(year + (month >= 10)).astype("Int64"),
+        )
+
+    def _rollup_select(self, model):
+        """
+        Builds the aggregate of AwardTable that a rollup table holds, the same
+        grouping `_rollup_keys` computes for new rows.
+
+        Args:
+            model: Rollup table class from `dao.award_rollups`.
+
+        Returns:
+            sqlalchemy.Select: Query with the key columns, `award_count` and
+                `award_amount`.
+        """
+        start_date = cast(AwardTable.start_date, String)
+        expressions = {
+            "awarding_agency": AwardTable.awarding_agency,
+            "awarding_sub_agency": AwardTable.awarding_sub_agency,
+            "award_type": AwardTable.award_type,
+            "month": func.substr(start_date, 1, 7),
+            "fiscal_year": cast(func.substr(start_date, 1, 4), Integer)
+            + case((func.substr(start_date, 6, 2) >= "10", 1), else_=0),
+        }
+        keys = [expressions[key].label(key) for key in ROLLUPS[model]]
+        return select(
+            *keys,
+            func.count().label("award_count"),
+            func.coalesce(func.sum(AwardTable.award_amount), 0.0).label("award_amount"),
+        ).group_by(*keys)
+
+    def _update_rollups(self, connection, df: pd.DataFrame):
+        """
+        Adds the totals of newly inserted awards to every rollup table, inside the
+        transaction that inserts them.
+
+        Args:
+            connection: Open SQLAlchemy connection inside the insert transaction.
+            df (pd.DataFrame): Awards as inserted into AwardTable.
+        """
+        df = self._rollup_keys(df).assign(award_amount=lambda df: pd.to_numeric(df["award_amount"]))
+        for model, keys in ROLLUPS.items():
+            deltas = df.groupby(keys, dropna=False).agg(
+                award_count=("award_id", "size"), award_amount=("award_amount", "sum")
+            ).reset_index()
+            # Read the rollup rows of the periods touched, to split updates from inserts
+            period = getattr(model, keys[-1])
+            values = [value for value in deltas[keys[-1]].dropna().unique().tolist()]
+            existing = pd.read_sql(
+                select(model.id, *(getattr(model, key) for key in keys)).where(
+                    or_(period.in_(values), period.is_(None))
+                ),
+                connection,
+            )
+            deltas = deltas.merge(existing.astype(deltas[keys].dtypes.to_dict()), on=keys, how="left")
+            deltas = deltas.astype(object).where(deltas.notna(), None)
+
+            updates = deltas[deltas["id"].notna()]
+            if not updates.empty:
+                connection.execute(
+                    update(model)
+                    .where(model.id == bindparam("rollup_id"))
+                    .values(
+                        award_count=model.award_count + bindparam("count_delta"),
+                        award_amount=model.award_amount + bindparam("amount_delta"),
+                    ),
+                    [
+                        {"rollup_id": int(row.id), "count_delta": int(row.award_count), "amount_delta": float(row.award_amount)}
+                        for row in updates.itertuples()
+                    ],
+                )
+            inserts = deltas[deltas["id"].isna()].drop(columns="id")
+            if not inserts.empty:
+                connection.execute(insert(model), inserts.to_dict("records"))
+
+    def rebuild_rollups(self):
+        """
+        Recomputes every rollup table from AwardTable, e.g. after loading awards
+        outside of `insert_into_db` or when `check_rollups` finds differences.
+        """
+        with self.engine.begin() as connection:
+            for model, keys in ROLLUPS.items():
+                connection.execute(delete(model))
+                connection.execute(
+                    insert(model).from_select([*keys, "award_count", "award_amount"], self._rollup_select(model))
+                )
+
+    def check_rollups(self) -> pd.DataFrame:
+        """
+        Compares every rollup table with an aggregate of AwardTable.
+
+        Returns:
+            pd.DataFrame: Groups whose count or amount differ, with the values of
+                the rollup (`_rollup`) and of the base table (`_base`). Empty when
+                the rollups are consistent.
+        """
+        mismatches = []
+        with self.engine.connect() as connection:
+            for model, keys in ROLLUPS.items():
+                base = pd.read_sql(self._rollup_select(model), connection)
+                rollup = pd.read_sql(select(model), connection).drop(columns="id")
+                merged = rollup.merge(base, on=keys, how="outer", suffixes=("_rollup", "_base"))
+                merged = merged.fillna({column: 0 for column in merged.columns if column not in keys})
+                bad = (merged["award_count_rollup"] != merged["award_count_base"]) | ~np.isclose(
+                    merged["award_amount_rollup"], merged["award_amount_base"]
+                )
+                mismatches.append(merged[bad].assign(rollup=model.__tablename__))
+        mismatches = pd.concat(mismatches, ignore_index=True)
+        if self.debug:
+            if mismatches.empty:
+                print("\033[0;32mSUCCESS: \033[0mAward rollups match AwardTable")
+            else:
+                print(f"\033[0;31mERROR: \033[0m{len(mismatches)} award rollup groups differ from AwardTable")
+        return mismatches
+
+    def agency_month_totals(
+        self, start_month: str = None, end_month: str = None, awarding_agency: str = None
+    ) -> pd.DataFrame:
+        """
+        Award count and amount by awarding agency, sub-agency and month, read from
+        the rollup table.
+
+        Args:
+            start_month (str): First month to include, as YYYY-MM.
+            end_month (str): Last month to include, as YYYY-MM.
+            awarding_agency (str): Only include this awarding agency.
+
+        Returns:
+            pd.DataFrame: One row per agency, sub-agency and month.
+        """
+        query = select(AwardAgencyMonthTable)
+        if start_month is not None:
+            query = query.where(AwardAgencyMonthTable.month >= start_month)
+        if end_month is not None:
+            query = query.where(AwardAgencyMonthTable.month <= end_month)
+        if awarding_agency is not None:
+            query = query.where(AwardAgencyMonthTable.awarding_agency == awarding_agency)
+        query = query.order_by(
+            AwardAgencyMonthTable.month, AwardAgencyMonthTable.awarding_agency, AwardAgencyMonthTable.awarding_sub_agency
+        )
+        return pd.read_sql(query, self.engine).drop(columns="id")
+
+    def type_year_totals(
+        self, start_year: int = None, end_year: int = None, award_type: str = None
+    ) -> pd.DataFrame:
+        """
+        Award count and amount by award type and fiscal year, read from the rollup
+        table.
+
+        Args:
+            start_year (int): First fiscal year to include.
+            end_year (int): Last fiscal year to include.
+            award_type (str): Only include this award type.
+
+        Returns:
+            pd.DataFrame: One row per award type and fiscal year.
+        """
+        query = select(AwardTypeYearTable)
+        if start_year is not None:
+            query = query.where(AwardTypeYearTable.fiscal_year >= start_year)
+        if end_year is not None:
+            query = query.where(AwardTypeYearTable.fiscal_year <= end_year)
+        if award_type is not None:
+            query = query.where(AwardTypeYearTable.award_type == award_type)
+        query = query.order_by(AwardTypeYearTable.fiscal_year, AwardTypeYearTable.award_type)
+        return pd.read_sql(query, self.engine).drop(columns="id")
@@ -1,10 +1,18 @@
+import asyncio
+import json
+import os
 import time
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
 
 # API configuration
 URL = "https://api.usaspending.gov/api/v2/search/spending_by_award/"
 HEADERS = {"Content-Type": "application/json"}
+CONCURRENCY = 8  # Maximum number of requests in flight at the same time
+RATE_LIMIT = 10  # Maximum number of requests started per second
 
 def build_payload(start_date: str, end_date: str) -> dict:
     """
@@ -64,22 +72,176 @@ def make_request(url: str, payload: dict, retries: int = 5) -> dict:
     print("Error: Request failed after multiple retries.")
     return None
 
-def get_data_for_year(year: int) -> list:
+class PageSink:
+    """
+    Spools pages of API results to disk as they arrive, so only the page being
+    written is held in memory. Each page is appended as one NDJSON line to
+    `<output_file>.pages.ndjson` and `compact` turns the spool into the final file.
+
+    Pages already in the spool of an interrupted download are kept and reported
+    in `pages`, so a rerun only requests the missing ones. The fetch calls
+    `finish` once it reaches the last page; until then the download is
+    incomplete and the spool cannot be compacted.
+
+    Args:
+        output_file (str): Path of the final CSV or Parquet file.
+    """
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.spool_file = f"{output_file}.pages.ndjson"
+        self.pages = {}  # Page number -> offset of its line in the spool
+        self.complete = False  # Whether the page after the last one was reached
+        if os.path.exists(self.spool_file):
+            self._recover()
+        self.file = open(self.spool_file, "ab")
+
+    def _recover(self) -> None:
+        """
+        Index the pages of an existing spool and drop a last line cut by a crash.
+        """
+        offset = 0
+        with open(self.spool_file, "rb+") as file:
+            for line in file:
+                try:
+                    self.pages[json.loads(line)["page"]] = offset
+                except (ValueError, KeyError):
+                    break
+                offset += len(line)
+            file.truncate(offset)
+
+    def write(self, page: int, results: list) -> None:
+        """
+        Append a page of results to the spool.
+
+        Args:
+            page (int): Page number, used to restore the order of the pages.
+            results (list): Awards of the page.
+        """
+        self.pages[page] = self.file.tell()
+        self.file.write(json.dumps({"page": page, "results": results}).encode() + b"\n")
+        self.file.flush()
+
+    def finish(self) -> None:
+        """
+        Mark the download as complete, after an empty page was returned.
+        """
+        self.complete = True
+
+    def read_pages(self):
+        """
+        Yield the results of each page in page order, one page at a time, stopping
+        at the first missing page.
+        """
+        self.file.flush()
+        with open(self.spool_file, "rb") as file:
+            page = 1
+            while page in self.pages:
+                file.seek(self.pages[page])
+                yield json.loads(file.readline())["results"]
+                page += 1
+
+    def _schema(self):
+        """
+        Build the schema of the output from every spooled page: the union of their
+        fields, in the order they first appear, each with a type that fits all of
+        its values. Fields whose values mix types that can't be cast to one another,
+        or hold lists or objects, are stored as strings.
+
+        Returns:
+            tuple: The Parquet schema and the names of the fields stored as strings
+                although some of their values are not.
+        """
+        kinds = {}  # Field name -> Python types of its values
+        for results in self.read_pages():
+            for result in results:
+                for key, value in result.items():
+                    kinds.setdefault(key, set()).add(type(value))
+        fields = []
+        stringify = set()
+        for key, types in kinds.items():
+            types = types - {type(None)}
+            if types and types <= {bool}:
+                fields.append(pa.field(key, pa.bool_()))
+            elif types and types <= {int}:
+                fields.append(pa.field(key, pa.int64()))
+            elif types and types <= {int, float}:
+                fields.append(pa.field(key, pa.float64()))
+            else:
+                fields.append(pa.field(key, pa.string()))
+                if types - {str}:
+                    stringify.add(key)
+        return pa.schema(fields), stringify
+
+    def compact(self) -> int:
+        """
+        Write the spooled pages to `output_file`, as CSV or as Parquet with one row
+        group per page depending on its extension, and remove the spool. Only a
+        complete download can be compacted. A first pass over the spool collects
+        the fields of every page, so fields missing from some pages or whose type
+        changes between pages are kept.
+
+        Returns:
+            int: Number of awards written.
+        """
+        if not self.complete:
+            raise RuntimeError(f"Download of {self.output_file} is incomplete, the spool is kept to resume it")
+        schema, stringify = self._schema()
+        rows = 0
+        writer = None
+        tmp_file = f"{self.output_file}.tmp"
+        try:
+            for results in self.read_pages():
+                if not results:
+                    continue
+                if self.output_file.endswith(".parquet"):
+                    if stringify:
+                        results = [
+                            {
+                                key: json.dumps(value) if key in stringify and not isinstance(value, (str, type(None))) else value
+                                for key, value in result.items()
+                            }
+                            for result in results
+                        ]
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_file, schema, compression="zstd")
+                    writer.write_table(pa.Table.from_pylist(results, schema=schema))
+                else:
+                    df = pd.DataFrame(results).reindex(columns=schema.names)
+                    df.to_csv(tmp_file, mode="a" if rows else "w", header=not rows, index=False)
+                rows += len(results)
+        finally:
+            if writer is not None:
+                writer.close()
+        self.close()
+        if rows:
+            os.replace(tmp_file, self.output_file)
+        os.remove(self.spool_file)
+        return rows
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def get_data_for_year(year: int, sink: PageSink) -> int:
     """
     Retrieve all award data for a specific fiscal year.
 
     Args:
         year (int): The fiscal year to retrieve data for.
+        sink (PageSink): Sink the pages are written to as they arrive.
 
     Returns:
-        list: A list of awards retrieved from the API.
+        int: Number of pages with awards.
     """
     start_date = f"{year - 1}-10-01"  # Fiscal year starts on Oct 1 of the previous year
     end_date = f"{year}-09-30"  # Fiscal year ends on Sep 30 of the current year
-    all_data = []
     page = 1
 
     while True:
+        if page in sink.pages:
+            page += 1
+            continue
         print(f"Downloading page {page} for FY {year}...")
         payload = build_payload(start_date, end_date)
         payload["page"] = page
@@ -92,25 +254,207 @@ def get_data_for_year(year: int) -> list:
         data = response.get("results", [])
         if not data:
             print(f"No more data available for FY {year}.")
+            sink.finish()
             break
 
-        all_data.extend(data)
+        sink.write(page, data)
         page += 1
 
-    return all_data
+    return page - 1
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter for asyncio tasks.
+
+    Args:
+        rate (float): Number of tokens added per second.
+        capacity (int): Maximum number of tokens the bucket can hold.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def make_session(concurrency: int = CONCURRENCY) -> requests.Session:
+    """
+    Create a session whose connection pool is large enough for every request in flight.
+
+    Args:
+        concurrency (int): Maximum number of requests in flight.
 
-def save_to_csv(data: list, year: int) -> None:
+    Returns:
+        requests.Session: Session that reuses connections to the API.
     """
-    Save the collected data to a CSV file.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+async def make_request_async(
+    session: requests.Session,
+    semaphore: asyncio.Semaphore,
+    limiter: TokenBucket,
+    url: str,
+    payload: dict,
+    retries: int = 5,
+) -> dict:
+    """
+    Asynchronous version of `make_request` with the same exponential backoff.
 
     Args:
-        data (list): List of awards data.
+        session (requests.Session): Shared session used to reuse connections.
+        semaphore (asyncio.Semaphore): Bounds the number of requests in flight.
+        limiter (TokenBucket): Rate limiter shared by every request.
+        url (str): API endpoint URL.
+        payload (dict): JSON payload with the filters and fields.
+        retries (int): Number of retry attempts before giving up.
+
+    Returns:
+        dict: JSON response from the API, or None if the request failed.
+    """
+    for attempt in range(retries):
+        await limiter.acquire()
+        try:
+            async with semaphore:
+                response = await asyncio.to_thread(session.post, url, json=payload, timeout=60)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as error:
+            wait_time = 2**attempt
+            print(f"Error: {error}. Retrying in {wait_time} seconds...")
+            await asyncio.sleep(wait_time)
+
+    print("Error: Request failed after multiple retries.")
+    return None
+
+async def get_data_for_year_async(
+    year: int,
+    session: requests.Session,
+    semaphore: asyncio.Semaphore,
+    limiter: TokenBucket,
+    sink: PageSink,
+    page_workers: int = CONCURRENCY,
+) -> int:
+    """
+    Retrieve all award data for a specific fiscal year, fetching several pages at once.
+
+    The number of pages is not known in advance, so `page_workers` tasks claim page
+    numbers in order until one of them finds the last page. At most
+    `page_workers - 1` requests past the last page are wasted. Each page is
+    written to `sink` as soon as it arrives and pages already in it are skipped.
+
+    Args:
+        year (int): The fiscal year to retrieve data for.
+        session (requests.Session): Shared session used to reuse connections.
+        semaphore (asyncio.Semaphore): Bounds the number of requests in flight.
+        limiter (TokenBucket): Rate limiter shared by every request.
+        sink (PageSink): Sink the pages are written to as they arrive.
+        page_workers (int): Number of pages requested concurrently for the year.
+
+    Returns:
+        int: Number of pages with awards.
+    """
+    start_date = f"{year - 1}-10-01"  # Fiscal year starts on Oct 1 of the previous year
+    end_date = f"{year}-09-30"  # Fiscal year ends on Sep 30 of the current year
+    next_page = 1
+    last_page = None
+    failed = False
+
+    async def worker():
+        nonlocal next_page, last_page, failed
+        while last_page is None or next_page < last_page:
+            page = next_page
+            next_page += 1
+            if page in sink.pages:
+                continue
+            print(f"Downloading page {page} for FY {year}...")
+            payload = build_payload(start_date, end_date)
+            payload["page"] = page
+
+            response = await make_request_async(session, semaphore, limiter, URL, payload)
+            if response is None:
+                # Stop requesting pages, the ones after this one cannot be compacted anyway
+                print(f"Error: No data received for FY {year}.")
+                failed = True
+            data = response.get("results", []) if response is not None else []
+            if data:
+                sink.write(page, data)
+            elif last_page is None or page < last_page:
+                last_page = page
+
+    await asyncio.gather(*(worker() for _ in range(page_workers)))
+    if not failed:
+        print(f"No more data available for FY {year}.")
+        sink.finish()
+    return last_page - 1
+
+async def get_data_for_years_async(
+    years: list, concurrency: int = CONCURRENCY, rate: float = RATE_LIMIT, output_format: str = "csv"
+) -> dict:
+    """
+    Retrieve award data for several fiscal years concurrently and save each year
+    to `prime_award_results_<year>.<output_format>`.
+
+    Args:
+        years (list): The fiscal years to retrieve data for.
+        concurrency (int): Maximum number of requests in flight across all years.
+        rate (float): Maximum number of requests started per second.
+        output_format (str): "csv" or "parquet".
+
+    Returns:
+        dict: Mapping of fiscal year to the number of awards saved, None for the
+            years whose download failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = TokenBucket(rate, capacity=concurrency)
+    sinks = {year: PageSink(f"prime_award_results_{year}.{output_format}") for year in years}
+    with make_session(concurrency) as session:
+        await asyncio.gather(
+            *(get_data_for_year_async(year, session, semaphore, limiter, sinks[year], concurrency) for year in years)
+        )
+    return {year: save_year(sink, year) for year, sink in sinks.items()}
+
+def save_year(sink: PageSink, year: int) -> int:
+    """
+    Compact the spooled pages of a fiscal year into its output file. If the
+    download did not reach the last page the spool is kept, so a rerun resumes it.
+
+    Args:
+        sink (PageSink): Sink holding the pages of the year.
         year (int): The fiscal year for which the data was retrieved.
+
+    Returns:
+        int: Number of awards saved, or None if the download is incomplete.
     """
-    df = pd.DataFrame(data)
-    output_file = f"prime_award_results_{year}.csv"
-    df.to_csv(output_file, index=False)
-    print(f"Data for FY {year} saved to {output_file}")
+    if not sink.complete:
+        sink.close()
+        print(f"Error: Download for FY {year} is incomplete, {len(sink.pages)} pages kept in {sink.spool_file}.")
+        return None
+    rows = sink.compact()
+    if rows:
+        print(f"Data for FY {year} saved to {sink.output_file}")
+    else:
+        print(f"No data available for FY {year}.")
+    return rows
 
 def main():
     """
@@ -119,14 +463,9 @@ def main():
     start_year = 2008  # Starting year (you can adjust this as needed)
     end_year = 2023  # Ending year (you can adjust this as needed)
 
-    for year in range(start_year, end_year + 1):
-        print(f"Starting data retrieval for FY {year}...")
-        data = get_data_for_year(year)
-
-        if data:
-            save_to_csv(data, year)
-        else:
-            print(f"No data available for FY {year}.")
+    years = list(range(start_year, end_year + 1))
+    print(f"Starting data retrieval for FY {start_year}-{end_year}...")
+    asyncio.run(get_data_for_years_async(years))
 
 if __name__ == "__main__":
     main()
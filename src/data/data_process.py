@@ -1,31 +1,88 @@
-from ..dao.economic_indicators_table import create_indicators_table
-from ..dao.consumer_table import create_consumer_table
-from sqlmodel import create_engine
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from .data_pull import DataPull
+from .metrics import stage
 from datetime import datetime
-import polars.selectors as cs
-import polars as pl
-import ibis
+from typing import TYPE_CHECKING
+import threading
+import hashlib
 import os
+import io
+
+if TYPE_CHECKING:
+    from sqlmodel import SQLModel
+    import polars as pl
+    import ibis
+
+# Engines and ibis connections shared by every DataIndex, keyed by database URL
+POOL = {}
+POOL_LOCK = threading.Lock()
+
+def connect(database_url:str):
+    """
+    Opens an ibis connection to the database.
+
+    Parameters
+    ----------
+    database_url : str
+        The URL of the database to connect to.
+
+    Returns
+    -------
+    ibis.BaseBackend
+    """
+    import ibis
+
+    if database_url.startswith("duckdb"):
+        return ibis.duckdb.connect(database_url.replace("duckdb://", "", 1).replace("/", "", 1) or ":memory:")
+    elif database_url.startswith("sqlite"):
+        return ibis.sqlite.connect(database_url.replace("sqlite:///", ""))
+    else:
+        return ibis.postgres.connect(
+            user=database_url.split("://")[1].split(":")[0],
+            password=database_url.split("://")[1].split(":")[1].split("@")[0],
+            host=database_url.split("://")[1].split(":")[1].split("@")[1],
+            port=database_url.split("://")[1].split(":")[2].split("/")[0],
+            database=database_url.split("://")[1].split(":")[2].split("/")[1])
+
+def pooled(kind:str, database_url:str, factory):
+    """
+    Returns the pooled engine or connection for a database URL, creating it with
+    `factory` on first use. SQLite connections can only be used by the thread that
+    opened them, so they are pooled per thread.
+    """
+    key = (kind, database_url)
+    if kind == "conn" and database_url.startswith("sqlite"):
+        key += (threading.get_ident(),)
+    with POOL_LOCK:
+        if key not in POOL:
+            POOL[key] = factory(database_url)
+        return POOL[key]
 
 class DataIndex(DataPull):
     """
     Data processing class that calculates multiple indicators from the DataPull class
     """
-    def __init__(self, database_url:str='sqlite:///db.sqlite', data_dir:str='data', debug:bool=False):
+    def __init__(self, database_url:str='sqlite:///db.sqlite', data_dir:str='data', debug:bool=False, layout:str='wide'):
         """
-        Constructor for the DataProcess class. Creates a connection to the database and 
-        creates the data directory if it does not exist.
+        Constructor for the DataProcess class. Validates the database URL and creates
+        the data directory if it does not exist. The database connection is opened on
+        first use and shared with every other instance using the same URL.
 
         Parameters
         ----------
         database_url : str
             The URL of the database to connect to. Defaults to 'sqlite:///db.sqlite'.
-            Can be any valid SQLAlchemy connection string.
+            Can be a SQLite or PostgreSQL SQLAlchemy connection string, or a DuckDB
+            one such as 'duckdb:///db.duckdb' ('duckdb://' for an in-memory database).
         data_dir : str
             The directory to store the data. Defaults to 'data/'.
         debug : bool
             Whether to print debug messages. Defaults to False.
+        layout : str
+            How the series are stored. 'wide' keeps one table per dataset with a
+            column per series, 'long' keeps every series as (series_id, date, value)
+            rows so new series need no schema change. Defaults to 'wide'.
 
         Returns
         -------
@@ -34,34 +91,36 @@ class DataIndex(DataPull):
         self.debug = debug
         super().__init__(debug)
         self.database_url = database_url
-        self.engine = create_engine(self.database_url)
         self.data_dir = data_dir
+        self.layout = layout
 
-        if self.database_url.startswith("sqlite"):
-            self.conn = ibis.sqlite.connect(self.database_url.replace("sqlite:///", ""))
-        elif self.database_url.startswith("postgres"):
-            self.conn = ibis.postgres.connect(
-                user=self.database_url.split("://")[1].split(":")[0],
-                password=self.database_url.split("://")[1].split(":")[1].split("@")[0],
-                host=self.database_url.split("://")[1].split(":")[1].split("@")[1],
-                port=self.database_url.split("://")[1].split(":")[2].split("/")[0],
-                database=self.database_url.split("://")[1].split(":")[2].split("/")[1])
-        else:
+        if not self.database_url.startswith(("duckdb", "sqlite", "postgres")):
             raise Exception("Database url is not supported")
+        if self.layout not in ("wide", "long"):
+            raise Exception("Layout is not supported")
 
         if not os.path.exists(f'{data_dir}/raw'):
             os.makedirs(f'{data_dir}/raw')
         if not os.path.exists(f'{data_dir}/processed'):
             os.makedirs(f'{data_dir}/processed')
-        if self.database_url.startswith("sqlite"):
-            self.conn = ibis.sqlite.connect(self.database_url.replace("sqlite:///", ""))
-        elif self.database_url.startswith("postgres"):
-            self.conn = ibis.postgres.connect(
-                user=self.database_url.split("://")[1].split(":")[0],
-                password=self.database_url.split("://")[1].split(":")[1].split("@")[0],
-                host=self.database_url.split("://")[1].split(":")[1].split("@")[1],
-                port=self.database_url.split("://")[1].split(":")[2].split("/")[0],
-                database=self.database_url.split("://")[1].split(":")[2].split("/")[1])
+
+    @property
+    def engine(self):
+        """
+        The SQLAlchemy engine of the database, or None for DuckDB which is only
+        reached through ibis.
+        """
+        if self.database_url.startswith("duckdb"):
+            return None
+        from sqlmodel import create_engine
+        return pooled("engine", self.database_url, create_engine)
+
+    @property
+    def conn(self):
+        """
+        The ibis connection to the database.
+        """
+        return pooled("conn", self.database_url, connect)
 
     def process_consumer(self, update:bool=False) -> ibis.expr.types.relations.Table:
         """
@@ -71,50 +130,616 @@ class DataIndex(DataPull):
         Parameters
         ----------
         update : bool
-            Whether to update the data. Defaults to False.
+            Whether to update the data. The refresh is skipped if the raw file has
+            not changed, otherwise only new or revised months are written.
+            Defaults to False.
 
         Returns
         -------
         pl.DataFrame
         """
+        import polars as pl
+
         if not os.path.exists(f"{self.data_dir}/raw/consumer.xls") or update:
-            self.pull_consumer(f"{self.data_dir}/raw/consumer.xls")
-        if "consumertable" not in self.conn.list_tables() or self.conn.table("consumertable").count().execute() == 0 or update:
-            create_consumer_table(self.engine)
-            df = pl.read_excel(f"{self.data_dir}/raw/consumer.xls", sheet_id=1)
-            names = df.head(1).to_dicts().pop()
-            names = {k: self.clean_name(v) for k, v in names.items()}
-            df = df.rename(names)
-            df = df.tail(-2).head(-1)
-            df = df.with_columns(pl.col('descripcion').str.to_lowercase())
-            df = df.with_columns((
-                pl.when(pl.col('descripcion').str.contains("ene")).then(pl.col('descripcion').str.replace("ene", "01").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("feb")).then(pl.col('descripcion').str.replace("feb", "02").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("mar")).then(pl.col('descripcion').str.replace("mar", "03").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("abr")).then(pl.col('descripcion').str.replace("abr", "04").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("may")).then(pl.col('descripcion').str.replace("may", "05").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("jun")).then(pl.col('descripcion').str.replace("jun", "06").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("jul")).then(pl.col('descripcion').str.replace("jul", "07").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("ago")).then(pl.col('descripcion').str.replace("ago", "08").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("sep")).then(pl.col('descripcion').str.replace("sep", "09").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("oct")).then(pl.col('descripcion').str.replace("oct", "10").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("nov")).then(pl.col('descripcion').str.replace("nov", "11").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .when(pl.col('descripcion').str.contains("dic")).then(pl.col('descripcion').str.replace("dic", "12").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
-                  .otherwise(pl.col('descripcion').str.split_exact('-', 1).struct.rename_fields(['year', 'month']).alias('date'))
-                )).unnest("date")
-            df = df.with_columns((
-                pl.when((pl.col("year").str.len_chars() == 2) & (pl.col("year").str.strip_chars().cast(pl.Int32) < 80)).then(pl.col("year").str.strip_chars().cast(pl.Int32) + 2000)
-                .when((pl.col("year").str.len_chars() == 2) & (pl.col("year").str.strip_chars().cast(pl.Int32) >= 80)).then(pl.col("year").str.strip_chars().cast(pl.Int32) + 1900)
-                .otherwise(pl.col("year").str.strip_chars().cast(pl.Int32)).alias("year")
-            ))
-            df = df.with_columns(date=pl.date(pl.col('year').cast(pl.String), pl.col('month'), 1)).sort(by="date")
-            df = df.with_columns(pl.col("date").cast(pl.String))
-            df = df.drop(['year', 'month', 'descripcion'])
-            df = df.with_columns(pl.all().exclude("date").cast(pl.Float64))
-            self.conn.insert("consumertable", df)
-            return self.conn.table("consumertable")
+            self.pull_consumer(f"{self.data_dir}/raw/consumer.xls", update=update)
+        populated = self.is_populated("consumer", "consumertable")
+        if not populated or update:
+            file_hash = self.file_hash(f"{self.data_dir}/raw/consumer.xls")
+            if populated and self.is_unchanged(self.refresh_key("consumer", "consumertable"), file_hash):
+                if self.debug:
+                    print("\033[0;36mNOTICE: \033[0m" + "consumer.xls has not changed, skipping refresh")
+                self.export_processed("consumer", "consumertable")
+                return self.stored_table("consumer", "consumertable")
+            from ..dao.consumer_table import ConsumerTable
+
+            with stage("sheet_parse", file="consumer.xls") as event:
+                df = pl.read_excel(f"{self.data_dir}/raw/consumer.xls", sheet_id=1)
+                df = self.clean_consumer(df)
+                event.rows = len(df)
+            if self.layout == "long":
+                self.append_series("consumer", df)
+            else:
+                self.create_table(ConsumerTable)
+                self.upsert_by_date("consumertable", ConsumerTable, df)
+            self.save_refresh(self.refresh_key("consumer", "consumertable"), f"{self.data_dir}/raw/consumer.xls", file_hash, df)
+            self.write_processed("consumer", df)
+            return self.stored_table("consumer", "consumertable")
+        else:
+            self.export_processed("consumer", "consumertable")
+            return self.stored_table("consumer", "consumertable")
+
+    def clean_consumer(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        Cleans the raw consumer price sheet and returns one row per month
+
+        Parameters
+        ----------
+        df : pl.DataFrame
+            The sheet as read from the Excel file
+
+        Returns
+        -------
+        pl.DataFrame
+        """
+        import polars as pl
+
+        names = df.head(1).to_dicts().pop()
+        names = {k: self.clean_name(v) for k, v in names.items()}
+        df = df.rename(names)
+        df = df.tail(-2).head(-1)
+        df = df.with_columns(pl.col('descripcion').str.to_lowercase())
+        df = df.with_columns((
+            pl.when(pl.col('descripcion').str.contains("ene")).then(pl.col('descripcion').str.replace("ene", "01").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("feb")).then(pl.col('descripcion').str.replace("feb", "02").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("mar")).then(pl.col('descripcion').str.replace("mar", "03").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("abr")).then(pl.col('descripcion').str.replace("abr", "04").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("may")).then(pl.col('descripcion').str.replace("may", "05").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("jun")).then(pl.col('descripcion').str.replace("jun", "06").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("jul")).then(pl.col('descripcion').str.replace("jul", "07").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("ago")).then(pl.col('descripcion').str.replace("ago", "08").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("sep")).then(pl.col('descripcion').str.replace("sep", "09").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("oct")).then(pl.col('descripcion').str.replace("oct", "10").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("nov")).then(pl.col('descripcion').str.replace("nov", "11").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .when(pl.col('descripcion').str.contains("dic")).then(pl.col('descripcion').str.replace("dic", "12").str.split_exact('-', 1).struct.rename_fields(['month', 'year']).alias('date'))
+              .otherwise(pl.col('descripcion').str.split_exact('-', 1).struct.rename_fields(['year', 'month']).alias('date'))
+            )).unnest("date")
+        df = df.with_columns((
+            pl.when((pl.col("year").str.len_chars() == 2) & (pl.col("year").str.strip_chars().cast(pl.Int32) < 80)).then(pl.col("year").str.strip_chars().cast(pl.Int32) + 2000)
+            .when((pl.col("year").str.len_chars() == 2) & (pl.col("year").str.strip_chars().cast(pl.Int32) >= 80)).then(pl.col("year").str.strip_chars().cast(pl.Int32) + 1900)
+            .otherwise(pl.col("year").str.strip_chars().cast(pl.Int32)).alias("year")
+        ))
+        df = df.with_columns(date=pl.date(pl.col('year').cast(pl.String), pl.col('month'), 1)).sort(by="date")
+        df = df.with_columns(pl.col("date").cast(pl.String))
+        df = df.drop(['year', 'month', 'descripcion'])
+        df = df.with_columns(pl.all().exclude("date").cast(pl.Float64))
+        return df
+
+    def file_hash(self, file_path:str) -> str:
+        """
+        Calculates the SHA-256 hash of a raw file.
+
+        Parameters
+        ----------
+        file_path : str
+            The path to the file
+
+        Returns
+        -------
+        str
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def refresh_key(self, dataset:str, table_name:str) -> str:
+        """
+        Returns the name the refreshes of a dataset are recorded under. Each layout
+        has its own record, so switching the layout of an existing database loads
+        the dataset into the other layout instead of skipping it.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        table_name : str
+            The name of the wide table of the dataset
+
+        Returns
+        -------
+        str
+        """
+        return table_name if self.layout == "wide" else f"observationtable:{dataset}"
+
+    def is_unchanged(self, table_name:str, file_hash:str) -> bool:
+        """
+        Checks whether a table was last loaded from a file with the given hash.
+
+        Parameters
+        ----------
+        table_name : str
+            The name of the table
+        file_hash : str
+            The hash of the raw file
+
+        Returns
+        -------
+        bool
+        """
+        from ..dao.refresh_table import RefreshTable
+
+        self.create_table(RefreshTable)
+        refresh = self.conn.table("refreshtable")
+        refresh = refresh.filter(refresh.table_name == table_name).select("file_hash").to_polars()
+        return not refresh.is_empty() and refresh["file_hash"][0] == file_hash
+
+    def save_refresh(self, table_name:str, file_path:str, file_hash:str, df:pl.DataFrame) -> None:
+        """
+        Records the hash of the raw file and the last date loaded into a table.
+
+        Parameters
+        ----------
+        table_name : str
+            The name of the table
+        file_path : str
+            The path to the raw file
+        file_hash : str
+            The hash of the raw file
+        df : pl.DataFrame
+            The DataFrame that was loaded, with a `date` column
+
+        Returns
+        -------
+        None
+        """
+        import polars as pl
+        from ..dao.refresh_table import RefreshTable
+        from sqlmodel import delete
+
+        self.create_table(RefreshTable)
+        last_date = df.select(self.date_key()).max().item()
+        self.execute(delete(RefreshTable).where(RefreshTable.table_name == table_name))
+        self.conn.insert("refreshtable", pl.DataFrame({
+            "table_name": [table_name],
+            "file_path": [file_path],
+            "file_hash": [file_hash],
+            "last_date": [last_date],
+        }))
+
+    def upsert_by_date(self, table_name:str, model:type[SQLModel], df:pl.DataFrame) -> int:
+        """
+        Inserts the rows of a DataFrame whose month is new or whose values differ from
+        the ones stored in the table. Stored rows for revised months are replaced in
+        the same transaction and keep their `id`; new months get ids after the last
+        stored one.
+
+        Parameters
+        ----------
+        table_name : str
+            The name of the table
+        model : type[SQLModel]
+            The SQLModel class of the table
+        df : pl.DataFrame
+            The processed DataFrame, with a `date` column
+
+        Returns
+        -------
+        int
+            The number of rows written
+        """
+        import polars as pl
+
+        # Rows are matched by month, the id is a row number and is not compared
+        values = [column for column in df.columns if column not in ("date", "id")]
+        existing = self.conn.table(table_name).select("id", "date", *values).to_polars()
+        existing = existing.with_columns(self.date_key()).drop("date").cast({column: df.schema[column] for column in values})
+        changed = df.with_columns(self.date_key()).join(
+            existing.drop("id"), on=["date_key", *values], how="anti", join_nulls=True)
+        if changed.is_empty():
+            return 0
+
+        from sqlmodel import String, cast, delete, func, insert, update
+
+        keys = changed["date_key"].to_list()
+        # Revised months keep their stored id, new months are numbered after the last one
+        last_id = existing["id"].max() or 0
+        changed = changed.drop("id", strict=False).join(existing.select("date_key", "id"), on="date_key", how="left").sort("date_key")
+        revised = changed["id"].is_not_null()
+        changed = changed.with_columns(pl.col("id").fill_null(
+            last_id + pl.col("id").is_null().cast(pl.Int64).cum_sum()).cast(pl.Int64))
+        changed = changed.with_columns(pl.col("date_key").str.to_date().alias("date")).drop("date_key")
+        with stage("db_insert", table=table_name) as event:
+            if self.engine is None:
+                # DuckDB rejects re-inserting a key deleted in the same transaction, so revised
+                # months are updated in place instead
+                self.conn.raw_sql("BEGIN TRANSACTION")
+                try:
+                    for row in changed.filter(revised).to_dicts():
+                        self.execute(update(model).where(model.id == row["id"]).values({column: row[column] for column in values}))
+                    if not revised.all():
+                        self.conn.insert(table_name, changed.filter(~revised))
+                except Exception:
+                    self.conn.raw_sql("ROLLBACK")
+                    raise
+                self.conn.raw_sql("COMMIT")
+            else:
+                with self.engine.begin() as connection:
+                    # The date column is typed as a date, rows from older string tables are matched by their prefix
+                    connection.execute(delete(model).where(func.substr(cast(model.date, String), 1, 10).in_(keys)))
+                    connection.execute(insert(model), changed.to_dicts())
+            event.rows = len(changed)
+        if self.debug:
+            print("\033[0;32mSUCCESS: \033[0m" + f"Upserted {len(changed)} rows into {table_name}")
+        return len(changed)
+
+    def is_populated(self, dataset:str, table_name:str) -> bool:
+        """
+        Checks whether a dataset has been loaded into the database, in the layout of
+        this instance.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        table_name : str
+            The name of the wide table of the dataset
+
+        Returns
+        -------
+        bool
+        """
+        tables = self.conn.list_tables()
+        if self.layout == "long":
+            if "seriestable" not in tables or "observationtable" not in tables:
+                return False
+            series = self.conn.table("seriestable")
+            return series.filter(series.dataset == dataset).count().execute() > 0
+        return table_name in tables and self.conn.table(table_name).count().execute() > 0
+
+    def stored_table(self, dataset:str, table_name:str) -> ibis.expr.types.relations.Table:
+        """
+        Returns the wide table of a dataset. In the long layout it is an expression
+        that pivots the stored series in the database.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        table_name : str
+            The name of the wide table of the dataset
+
+        Returns
+        -------
+        ibis.expr.types.relations.Table
+        """
+        if self.layout == "long":
+            series = self.conn.table("seriestable")
+            series = series.filter(series.dataset == dataset)
+            columns = series.order_by("id").name.to_pyarrow().to_pylist()
+            observations = self.conn.table("observationtable")
+            # Revisions are appended, the row with the highest id is the current value
+            latest = observations.group_by(["series_id", "date"]).aggregate(id=observations.id.max())
+            df = observations.filter(observations.id.isin(latest.id))
+            df = df.join(series.select(series_id="id", name="name"), "series_id").select("date", "name", "value")
+            df = df.pivot_wider(names_from="name", values_from="value", names=columns, values_agg="max")
+            return df.select("date", *columns).order_by("date")
+        return self.conn.table(table_name)
+
+    def register_series(self, dataset:str, names:list[str]) -> pl.DataFrame:
+        """
+        Adds the series of a dataset that are not in the series table yet.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        names : list[str]
+            The names of the series
+
+        Returns
+        -------
+        pl.DataFrame
+            The `series_id` and `name` of every series of the dataset
+        """
+        import polars as pl
+
+        series = self.conn.table("seriestable")
+        series = series.filter(series.dataset == dataset).select(series_id="id", name="name")
+        existing = series.to_polars()
+        missing = [name for name in names if name not in existing["name"].to_list()]
+        if missing:
+            self.conn.insert("seriestable", pl.DataFrame({"dataset": [dataset] * len(missing), "name": missing}))
+            existing = series.to_polars()
+        return existing
+
+    def latest_observations(self, dataset:str, columns:list[str]|None=None, start:str|None=None, end:str|None=None) -> pl.DataFrame:
+        """
+        Reads the latest value of every date of the series of a dataset from the long
+        layout. The series and date filters run in the database.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        columns : list[str]
+            The series to read. Defaults to all of them.
+        start : str
+            The first date to include, as 'YYYY-MM-DD'. Defaults to no lower bound.
+        end : str
+            The last date to include, as 'YYYY-MM-DD'. Defaults to no upper bound.
+
+        Returns
+        -------
+        pl.DataFrame
+            The `name`, `date` and `value` of each observation
+        """
+        series = self.conn.table("seriestable")
+        series = series.filter(series.dataset == dataset)
+        if columns is not None:
+            series = series.filter(series.name.isin(columns))
+        observations = self.conn.table("observationtable")
+        if start is not None:
+            observations = observations.filter(observations.date >= datetime.strptime(start, "%Y-%m-%d").date())
+        if end is not None:
+            observations = observations.filter(observations.date <= datetime.strptime(end, "%Y-%m-%d").date())
+        df = observations.join(series.select(series_id="id", name="name"), "series_id")
+        df = df.select("id", "name", "date", "value").to_polars()
+        # Revisions are appended, the row with the highest id is the current value
+        return df.sort("id").unique(["name", "date"], keep="last", maintain_order=True).select("name", "date", "value")
+
+    def append_series(self, dataset:str, df:pl.DataFrame) -> int:
+        """
+        Stores a wide DataFrame in the long layout. Only observations that are new or
+        whose value changed are appended; stored rows are never updated. Missing
+        values are skipped unless they replace a stored one.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        df : pl.DataFrame
+            The processed DataFrame, with a `date` column and one column per series
+
+        Returns
+        -------
+        int
+            The number of observations written
+        """
+        import polars as pl
+        from ..dao.series_table import SeriesTable, ObservationTable
+
+        self.create_table(SeriesTable)
+        self.create_table(ObservationTable)
+        names = [column for column in df.columns if column != "date"]
+        series = self.register_series(dataset, names)
+
+        df = df.with_columns(self.date_key().str.to_date().alias("date"))
+        df = df.unpivot(index="date", on=names, variable_name="name", value_name="value")
+        df = df.join(series, on="name").select(pl.col("series_id").cast(pl.Int16), "date", pl.col("value").cast(pl.Float64))
+        latest = self.latest_observations(dataset).join(series, on="name")
+        latest = latest.select(pl.col("series_id").cast(pl.Int16), pl.col("date").cast(pl.Date), pl.col("value").cast(pl.Float64))
+        changed = df.join(latest, on=["series_id", "date", "value"], how="anti", join_nulls=True)
+        # Missing values are only stored to mask a value loaded before
+        changed = pl.concat([
+            changed.filter(pl.col("value").is_not_null()),
+            changed.filter(pl.col("value").is_null()).join(latest, on=["series_id", "date"], how="semi"),
+        ])
+        if changed.is_empty():
+            return 0
+
+        if self.database_url.startswith("sqlite"):
+            changed = changed.with_columns(pl.col("date").cast(pl.String))
+        with stage("db_insert", table="observationtable") as event:
+            self.conn.insert("observationtable", changed)
+            event.rows = len(changed)
+        if self.debug:
+            print("\033[0;32mSUCCESS: \033[0m" + f"Appended {len(changed)} {dataset} observations")
+        return len(changed)
+
+    def series_view(self, dataset:str, columns:list[str]|None=None, start:str|None=None, end:str|None=None) -> pl.DataFrame:
+        """
+        Rebuilds the wide view of a dataset stored in the long layout, with one column
+        per series in the order they were first loaded.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        columns : list[str]
+            The series to read. Defaults to all of them.
+        start : str
+            The first date to include, as 'YYYY-MM-DD'. Defaults to no lower bound.
+        end : str
+            The last date to include, as 'YYYY-MM-DD'. Defaults to no upper bound.
+
+        Returns
+        -------
+        pl.DataFrame
+        """
+        import polars as pl
+
+        if columns is None:
+            series = self.conn.table("seriestable")
+            columns = series.filter(series.dataset == dataset).order_by("id").name.to_pyarrow().to_pylist()
+        columns = [column for column in columns if column != "date"]
+        df = self.latest_observations(dataset, columns, start, end)
+        df = df.pivot(on="name", index="date", values="value")
+        df = df.with_columns(pl.lit(None, dtype=pl.Float64).alias(name) for name in columns if name not in df.columns)
+        return df.select(pl.col("date").cast(pl.Date), *columns).sort("date")
+
+    def create_table(self, model:type[SQLModel]) -> None:
+        """
+        Creates the table of a SQLModel class if it does not exist.
+
+        Parameters
+        ----------
+        model : type[SQLModel]
+            The SQLModel class of the table
+
+        Returns
+        -------
+        None
+        """
+        from ..dao.duckdb_schema import create_duckdb_table
+        from sqlmodel import SQLModel
+
+        if self.engine is None:
+            create_duckdb_table(self.conn, model)
+        else:
+            SQLModel.metadata.create_all(self.engine, tables=[model.__table__])
+
+    def execute(self, statement) -> None:
+        """
+        Executes a SQLAlchemy statement that returns no rows, e.g. a DELETE. On DuckDB
+        the statement is compiled with its parameters inlined and run through ibis.
+
+        Parameters
+        ----------
+        statement : sqlalchemy.sql.Executable
+            The statement to execute
+
+        Returns
+        -------
+        None
+        """
+        from sqlalchemy.dialects import postgresql
+
+        if self.engine is None:
+            self.conn.raw_sql(str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})))
         else:
-            return self.conn.table("consumertable")
+            with self.engine.begin() as connection:
+                connection.execute(statement)
+
+    def date_key(self) -> pl.Expr:
+        """
+        Expression that normalizes the `date` column to a `YYYY-MM-DD` string, so dates
+        read back from the database can be compared with freshly processed ones.
+
+        Returns
+        -------
+        pl.Expr
+        """
+        import polars as pl
+
+        return pl.col("date").cast(pl.String).str.slice(0, 10).alias("date_key")
+
+    def write_processed(self, dataset:str, df:pl.DataFrame) -> None:
+        """
+        Writes a processed dataset to `processed/<dataset>.parquet` with a `date`
+        column typed as a date and zstd compression. The file is replaced atomically.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        df : pl.DataFrame
+            The processed DataFrame, with a `date` column
+
+        Returns
+        -------
+        None
+        """
+        import polars as pl
+
+        df = df.with_columns(self.date_key().str.to_date().alias("date"))
+        df = df.select("date", pl.all().exclude("date", "id")).sort("date")
+        file_path = f"{self.data_dir}/processed/{dataset}.parquet"
+        with stage("parquet_write", dataset=dataset) as event:
+            df.write_parquet(f"{file_path}.tmp", compression="zstd", statistics=True)
+            os.replace(f"{file_path}.tmp", file_path)
+            event.rows = len(df)
+            event.bytes = os.path.getsize(file_path)
+
+    def export_processed(self, dataset:str, table_name:str) -> None:
+        """
+        Writes the Parquet file of a dataset from its database table if it does not exist.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        table_name : str
+            The name of the table the dataset is stored in
+
+        Returns
+        -------
+        None
+        """
+        if not os.path.exists(f"{self.data_dir}/processed/{dataset}.parquet"):
+            if self.layout == "long":
+                self.write_processed(dataset, self.series_view(dataset))
+            else:
+                self.write_processed(dataset, self.conn.table(table_name).to_polars())
+
+    def scan_processed(self, dataset:str, columns:list[str]|None=None, start:str|None=None, end:str|None=None) -> pl.LazyFrame:
+        """
+        Lazily scans a processed dataset. Only the selected columns and the row groups
+        that overlap the date range are read from disk.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of the dataset, e.g. 'consumer' or 'indicators'
+        columns : list[str]
+            The series to read. Defaults to all of them.
+        start : str
+            The first date to include, as 'YYYY-MM-DD'. Defaults to no lower bound.
+        end : str
+            The last date to include, as 'YYYY-MM-DD'. Defaults to no upper bound.
+
+        Returns
+        -------
+        pl.LazyFrame
+        """
+        import polars as pl
+
+        df = pl.scan_parquet(f"{self.data_dir}/processed/{dataset}.parquet")
+        if start is not None:
+            df = df.filter(pl.col("date") >= datetime.strptime(start, "%Y-%m-%d").date())
+        if end is not None:
+            df = df.filter(pl.col("date") <= datetime.strptime(end, "%Y-%m-%d").date())
+        if columns is not None:
+            df = df.select("date", *[column for column in columns if column != "date"])
+        return df
+
+    def query(self, table_name:str, columns:list[str]|None=None, start:str|None=None, end:str|None=None) -> pl.DataFrame:
+        """
+        Reads a date range of selected series from a table. The filter and the column
+        selection run in the database, so only the requested rows are transferred
+        and the index on `date` is used.
+
+        Parameters
+        ----------
+        table_name : str
+            The name of the table, e.g. 'consumertable' or 'indicatorstable'
+        columns : list[str]
+            The series to read. Defaults to all of them.
+        start : str
+            The first date to include, as 'YYYY-MM-DD'. Defaults to no lower bound.
+        end : str
+            The last date to include, as 'YYYY-MM-DD'. Defaults to no upper bound.
+
+        Returns
+        -------
+        pl.DataFrame
+        """
+        table = self.conn.table(table_name)
+        date = table.date
+        if date.type().is_string():
+            # Tables created before the date column was typed hold 'YYYY-MM-DD ...' strings
+            date = date.substr(0, 10)
+            bounds = start, end
+        else:
+            bounds = [None if bound is None else datetime.strptime(bound, "%Y-%m-%d").date() for bound in (start, end)]
+        if bounds[0] is not None:
+            table = table.filter(date >= bounds[0])
+        if bounds[1] is not None:
+            table = table.filter(date <= bounds[1])
+        if columns is None:
+            columns = [column for column in table.columns if column != "id"]
+        table = table.select("date", *[column for column in columns if column != "date"])
+        return table.order_by("date").to_polars()
 
     def clean_name(self, name:str) -> str:
         """
@@ -148,7 +773,7 @@ class DataIndex(DataPull):
             cleaned = cleaned.replace(old, new)
         return cleaned
 
-    def process_jp_index(self, update:bool=False) -> ibis.expr.types.relations.Table:
+    def process_jp_index(self, update:bool=False, workers:int=1) -> ibis.expr.types.relations.Table:
         """
         Processes the economic indicators data and stores it in the database. 
         If the data does not exist, it will pull the data from the source.
@@ -156,7 +781,11 @@ class DataIndex(DataPull):
         Parameters
         ----------
         update : bool
-            Whether to update the data. Defaults to False.
+            Whether to update the data. The refresh is skipped if the raw file has
+            not changed, otherwise only new or revised months are written.
+            Defaults to False.
+        workers : int
+            Number of threads used to parse the workbook sheets. Defaults to 1.
 
         Returns
         -------
@@ -164,21 +793,34 @@ class DataIndex(DataPull):
         """
 
         if not os.path.exists(f"{self.data_dir}/raw/economic_indicators.xlsx") or update:
-            self.pull_economic_indicators(f"{self.data_dir}/raw/economic_indicators.xlsx")
-        if "indicatorstable" not in self.conn.list_tables() or self.conn.table("indicatorstable").count().execute() == 0 or update:
-            create_indicators_table(self.engine)
-
-            jp_df = self.process_sheet(f"{self.data_dir}/raw/economic_indicators.xlsx", 3)
-
-            for sheet in range(4, 20):
-                df = self.process_sheet(f"{self.data_dir}/raw/economic_indicators.xlsx", sheet)
-                jp_df = jp_df.join(df, on=['date'], how='left', validate="1:1")
-
-            jp_df = jp_df.sort(by="date").with_columns(id=pl.col("date").rank().cast(pl.Int64))
-            self.conn.insert("indicatorstable", jp_df)
-            return self.conn.table("indicatorstable")
+            self.pull_economic_indicators(f"{self.data_dir}/raw/economic_indicators.xlsx", update=update)
+        populated = self.is_populated("indicators", "indicatorstable")
+        if not populated or update:
+            file_hash = self.file_hash(f"{self.data_dir}/raw/economic_indicators.xlsx")
+            if populated and self.is_unchanged(self.refresh_key("indicators", "indicatorstable"), file_hash):
+                if self.debug:
+                    print("\033[0;36mNOTICE: \033[0m" + "economic_indicators.xlsx has not changed, skipping refresh")
+                self.export_processed("indicators", "indicatorstable")
+                return self.stored_table("indicators", "indicatorstable")
+            from ..dao.economic_indicators_table import IndicatorsTable
+
+            panels = self.process_workbook(f"{self.data_dir}/raw/economic_indicators.xlsx", list(range(3, 20)), workers)
+            with stage("join", table="indicatorstable") as event:
+                jp_df = self.join_panels(panels)
+                event.rows = len(jp_df)
+
+            jp_df = jp_df.sort(by="date")
+            if self.layout == "long":
+                self.append_series("indicators", jp_df)
+            else:
+                self.create_table(IndicatorsTable)
+                self.upsert_by_date("indicatorstable", IndicatorsTable, jp_df)
+            self.save_refresh(self.refresh_key("indicators", "indicatorstable"), f"{self.data_dir}/raw/economic_indicators.xlsx", file_hash, jp_df)
+            self.write_processed("indicators", jp_df)
+            return self.stored_table("indicators", "indicatorstable")
         else:
-            return self.conn.table("indicatorstable")
+            self.export_processed("indicators", "indicatorstable")
+            return self.stored_table("indicators", "indicatorstable")
 
     def process_sheet(self, file_path : str, sheet_id: int) -> pl.DataFrame:
         """
@@ -196,14 +838,101 @@ class DataIndex(DataPull):
         -------
         pl.DataFrame
         """
-        df = pl.read_excel(file_path, sheet_id=sheet_id)
+        import polars as pl
+
+        with stage("sheet_parse", sheet=sheet_id) as event:
+            df = pl.read_excel(file_path, sheet_id=sheet_id)
+            event.rows = len(df)
+        return self.clean_sheet(df)
+
+    def process_workbook(self, file_path:str, sheet_ids:list[int], workers:int=1) -> list[pl.DataFrame]:
+        """
+        Processes several sheets from the economic indicators data. The workbook is
+        read from disk once and the sheets are split between a pool of threads, each
+        of which opens the in-memory workbook a single time for its share of sheets.
+
+        Parameters
+        ----------
+        file_path : str
+            The path to the Excel file
+        sheet_ids : list[int]
+            The sheet IDs to process
+        workers : int
+            Number of threads used to parse the sheets. Defaults to 1.
+
+        Returns
+        -------
+        list[pl.DataFrame]
+            The panel DataFrames in the same order as `sheet_ids`
+        """
+        import polars as pl
+
+        with open(file_path, "rb") as file:
+            workbook = file.read()
+        workers = max(1, min(workers, len(sheet_ids)))
+        chunks = [sheet_ids[i::workers] for i in range(workers)]
+
+        def parse(chunk: list[int]) -> dict[int, pl.DataFrame]:
+            with stage("sheet_parse", sheets=len(chunk)) as event:
+                sheets = pl.read_excel(io.BytesIO(workbook), sheet_id=chunk)
+                event.rows = sum(len(df) for df in sheets.values())
+            return {sheet_id: self.clean_sheet(df) for sheet_id, df in zip(chunk, sheets.values())}
+
+        panels = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for result in executor.map(parse, chunks):
+                panels.update(result)
+        return [panels[sheet_id] for sheet_id in sheet_ids]
+
+    def join_panels(self, panels:list[pl.DataFrame]) -> pl.DataFrame:
+        """
+        Joins panel DataFrames on `date` in a single pass. The dates of the first
+        panel are kept, as with a chain of left joins.
+
+        Parameters
+        ----------
+        panels : list[pl.DataFrame]
+            The panel DataFrames with a `date` column and one value column each
+
+        Returns
+        -------
+        pl.DataFrame
+        """
+        import polars as pl
+
+        series = [panel.columns[1] for panel in panels]
+        df = pl.concat([
+            panel.unpivot(index="date", variable_name="series", value_name="value")
+            for panel in panels
+        ])
+        df = df.filter(pl.col("date").is_in(panels[0]["date"]))
+        # pivot raises on duplicated dates, matching the 1:1 validation of a join
+        df = df.pivot(on="series", index="date", values="value")
+        df = df.with_columns(pl.lit(None, dtype=pl.Float64).alias(name) for name in series if name not in df.columns)
+        return df.select("date", *series)
+
+    def clean_sheet(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        Cleans a raw sheet from the economic indicators data and returns a panel DataFrame
+
+        Parameters
+        ----------
+        df : pl.DataFrame
+            The sheet as read from the Excel file
+
+        Returns
+        -------
+        pl.DataFrame
+        """
+        import polars as pl
+
         months = ["Enero", "Febrero", "Marzo",
                   "Abril", "Mayo", "Junio", "Julio",
                   "Agosto", "Septiembre", "Octubre",
                   "Noviembre", "Diciembre", "Meses"]
         col_name = self.clean_name(df.columns[1])
 
-        df = df.filter(pl.nth(1).is_in(months)).drop(cs.first()).head(13)
+        df = df.filter(pl.nth(1).is_in(months)).drop(pl.selectors.first()).head(13)
         columns = df.head(1).with_columns(pl.all()).cast(pl.String).to_dicts().pop()
         for item in columns:
           if columns[item] == "Meses":
@@ -218,7 +947,9 @@ class DataIndex(DataPull):
 
         df = df.rename(df.head(1).with_columns(pl.nth(range(1, len(df.columns))).cast(pl.Int64)).cast(pl.String).to_dicts().pop()).tail(-1)
         df = df.with_columns(pl.col("Meses").str.to_lowercase()).cast(pl.String)
-        df = self.process_panel(df, col_name)
+        with stage("panel_reshape", series=col_name) as event:
+            df = self.process_panel(df, col_name)
+            event.rows = len(df)
 
         return df
 
@@ -237,54 +968,37 @@ class DataIndex(DataPull):
         -------
         pl.DataFrame
         """
-        empty_df = [
-            pl.Series("date", [], dtype=pl.Datetime),
-            pl.Series(col_name, [], dtype=pl.Float64)
-        ]
-        clean_df = pl.DataFrame(empty_df)
-
-        for column in df.columns:
-            if column == "Meses":
-                continue
-            column_name = col_name
-            # Create a temporary DataFrame
-            tmp = df
-            tmp = tmp.rename({column:column_name})
-            tmp = tmp.with_columns(
-            pl.when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "enero").then(1)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "febrero").then(2)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "marzo").then(3)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "abril").then(4)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "mayo").then(5)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "junio").then(6)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "julio").then(7)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "agosto").then(8)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "septiembre").then(9)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "octubre").then(10)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "noviembre").then(11)
-                .when(pl.col("Meses").str.strip_chars().str.to_lowercase() == "diciembre").then(12)
-                .alias("month"))
-            tmp = tmp.with_columns((
-                pl.col(column_name).str.replace_all("$", "", literal=True)
-                                    .str.replace_all("(", "", literal=True)
-                                    .str.replace_all(")", "", literal=True)
-                                    .str.replace_all(",", "")
-                                    .str.replace_all("-","")
-                                    .str.strip_chars().alias(column_name)))
-            tmp = tmp.with_columns(
-                pl.when(pl.col(column_name)  == "n/d").then(None)
-                .when(pl.col(column_name)  == "**").then(None)
-                .when(pl.col(column_name)  == "-").then(None)
-                .when(pl.col(column_name)  == "no disponible").then(None)
-                .otherwise(pl.col(column_name)).alias(column_name))
-            tmp = tmp.select(
-                            pl.col("month").cast(pl.Int64).alias("month"),
-                            pl.lit(int(column)).cast(pl.Int64).alias("year"),
-                            pl.col(column_name).cast(pl.Float64).alias(column_name))
-
-            tmp = tmp.with_columns((pl.col("year").cast(pl.String) + "-" + pl.col("month").cast(pl.String) + "-01").alias("date"))
-            tmp = tmp.select(pl.col("date").str.to_datetime("%Y-%m-%d").alias("date"),
-                                pl.col(column_name).alias(column_name))
-
-            clean_df = pl.concat([clean_df, tmp], how="vertical")
-        return clean_df
+        import polars as pl
+
+        months = pl.DataFrame({
+            "Meses": ["enero", "febrero", "marzo",
+                      "abril", "mayo", "junio", "julio",
+                      "agosto", "septiembre", "octubre",
+                      "noviembre", "diciembre"],
+            "month": list(range(1, 13)),
+        })
+        years = [column for column in df.columns if column != "Meses"]
+        if not years:
+            return pl.DataFrame([
+                pl.Series("date", [], dtype=pl.Datetime),
+                pl.Series(col_name, [], dtype=pl.Float64)
+            ])
+
+        # Unpivot every year column at once; the result keeps the year-by-year
+        # ordering of the original column loop
+        df = df.with_columns(pl.col("Meses").str.strip_chars().str.to_lowercase())
+        df = df.unpivot(index="Meses", on=years, variable_name="year", value_name=col_name)
+        df = df.join(months, on="Meses", how="left")
+        df = df.with_columns((
+            pl.col(col_name).str.replace_all("$", "", literal=True)
+                            .str.replace_all("(", "", literal=True)
+                            .str.replace_all(")", "", literal=True)
+                            .str.replace_all(",", "")
+                            .str.replace_all("-", "")
+                            .str.strip_chars().alias(col_name)))
+        df = df.with_columns(
+            pl.when(pl.col(col_name).is_in(["n/d", "**", "-", "no disponible"])).then(None)
+            .otherwise(pl.col(col_name)).alias(col_name))
+        return df.select(
+            pl.datetime(pl.col("year").cast(pl.Int64), pl.col("month"), 1).alias("date"),
+            pl.col(col_name).cast(pl.Float64).alias(col_name))
@@ -1,48 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
+from .metrics import stage
+import threading
 import requests
+import json
 import os
 
 
 class DataPull:
+    # Raw files pulled by pull_all, mapped to the method that downloads each one
+    SOURCES = {
+        "economic_indicators.xlsx": "pull_economic_indicators",
+        "consumer.xls": "pull_consumer",
+    }
+    ECONOMIC_INDICATORS_URL = "https://jp.pr.gov/wp-content/uploads/2024/09/Indicadores_Economicos_9.13.2024.xlsx"
+    CONSUMER_URL = "https://www.mercadolaboral.pr.gov/Tablas_Estadisticas/Otras_Tablas/T_Indice_Precio.aspx"
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self, debug:bool=False):
         self.debug = debug
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The HTTP session shared by every download, with a connection pool large
+        enough for all the sources to be pulled at the same time.
+        """
+        with self._session_lock:
+            if self._session is None:
+                retry = Retry(
+                    total=5,  # Number of retries
+                    backoff_factor=1,  # Wait 1s, 2s, 4s, etc., between retries
+                    status_forcelist=[500, 502, 503, 504],  # Retry on these status codes
+                )
+                adapter = HTTPAdapter(max_retries=retry, pool_maxsize=max(10, len(self.SOURCES)))
+                self._session = requests.Session()
+                self._session.mount("http://", adapter)
+                self._session.mount("https://", adapter)
+            return self._session
+
+    def read_meta(self, filename:str) -> dict:
+        """
+        Reads the metadata stored next to a downloaded file, empty if there is none.
+        """
+        try:
+            with open(f"{filename}.meta.json") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def write_meta(self, filename:str, meta:dict) -> None:
+        """
+        Writes the metadata of a downloaded file to `<filename>.meta.json`.
+        """
+        with open(f"{filename}.meta.json.tmp", "w") as file:
+            json.dump(meta, file)
+        os.replace(f"{filename}.meta.json.tmp", f"{filename}.meta.json")
+
+    def download(self, url:str, filename:str, method:str="GET", verify:bool=True, headers:dict=None, **kwargs) -> bool:
+        """
+        Downloads a file with a conditional request, using the ETag and Last-Modified
+        of the previous download. The body is written to `<filename>.part`, which is
+        resumed with a Range request if an earlier transfer was interrupted, and only
+        replaces `filename` once it is complete.
+
+        Returns True if the file was downloaded, False if it has not changed or the
+        request failed.
+        """
+        part = f"{filename}.part"
+        meta = self.read_meta(filename) if os.path.exists(filename) else {}
+        part_meta = self.read_meta(part) if os.path.exists(part) else {}
+        headers = dict(headers or {})
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        # Resume only if the partial body can be validated against the current one
+        validator = part_meta.get("etag") or part_meta.get("last_modified")
+        offset = os.path.getsize(part) if validator else 0
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+
+        with stage("download", file=os.path.basename(filename)) as event, \
+                self.session.request(method, url, headers=headers, stream=True, verify=verify, **kwargs) as response:
+            if response.status_code == 304:
+                if self.debug:
+                    print("\033[0;36mNOTICE: \033[0m" + f"File {filename} has not changed, skipping download")
+                return False
+            if response.status_code == 416 and offset:
+                # The partial file is no longer valid, start over
+                os.remove(part)
+                os.remove(f"{part}.meta.json")
+                response.close()
+                return self.download(url, filename, method, verify, headers={key: value for key, value in headers.items() if key not in ("Range", "If-Range")}, **kwargs)
+            if response.status_code not in (200, 206):
+                if self.debug:
+                    print(f"\033[0;31mERROR: \033[0mFailed to download {filename}. Status code: {response.status_code}")
+                return False
+
+            if response.status_code == 206:
+                mode = "ab"
+            else:
+                offset = 0
+                mode = "wb"
+                part_meta = {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+                self.write_meta(part, part_meta)
+            total_size = offset + int(response.headers.get('content-length', 0))
+
+            with tqdm(total=total_size, initial=offset, unit='B', unit_scale=True, unit_divisor=1024, desc='Downloading') as bar:
+                with open(part, mode) as file:
+                    for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                        if chunk:
+                            file.write(chunk)
+                            bar.update(len(chunk))  # Update the progress bar with the size of the chunk
+            event.bytes = bar.n - offset
+
+        os.replace(part, filename)
+        self.write_meta(filename, {**part_meta, "size": os.path.getsize(filename)})
+        os.remove(f"{part}.meta.json")
+        if self.debug:
+            print("\033[0;32mSUCCESS: \033[0m" + f"Downloaded {filename}")
+        return True
 
-    def pull_file(self, url:str, filename:str, verify:bool=True) -> None:
-        if os.path.exists(filename):
+    def pull_file(self, url:str, filename:str, verify:bool=True, update:bool=False) -> bool:
+        if os.path.exists(filename) and not update:
             if self.debug:
                 print("\033[0;36mNOTICE: \033[0m" + f"File {filename} already exists, skipping download")
-        else:
-            chunk_size = 10 * 1024 * 1024
-
-            with requests.get(url, stream=True, verify=verify) as response:
-                total_size = int(response.headers.get('content-length', 0))
-
-                with tqdm(total=total_size, unit='B', unit_scale=True, unit_divisor=1024, desc='Downloading') as bar:
-                    with open(filename, 'wb') as file:
-                        for chunk in response.iter_content(chunk_size=chunk_size):
-                            if chunk:
-                                file.write(chunk)
-                                bar.update(len(chunk))  # Update the progress bar with the size of the chunk
+            return False
+        return self.download(url, filename, verify=verify)
+
+    def pull_all(self, raw_dir:str, update:bool=False, workers:int=None) -> dict:
+        """
+        Pulls every file in SOURCES into `raw_dir` at the same time, through the
+        shared session. Returns whether each file was downloaded.
+        """
+        def pull(item):
+            name, method = item
+            return name, getattr(self, method)(f"{raw_dir}/{name}", update=update)
+
+        with ThreadPoolExecutor(max_workers=workers or len(self.SOURCES)) as executor:
+            return dict(executor.map(pull, self.SOURCES.items()))
+
+    def pull_economic_indicators(self, file_path: str, update:bool=False) -> bool:
+        return self.pull_file(self.ECONOMIC_INDICATORS_URL, file_path, update=update)
+
+    def pull_consumer(self, file_path: str, update:bool=False) -> bool:
+        if os.path.exists(file_path) and not update:
             if self.debug:
-                print("\033[0;32mSUCCESS: \033[0m" + f"Downloaded {filename}")
-
-    def pull_economic_indicators(self, file_path: str):
-        url = "https://jp.pr.gov/wp-content/uploads/2024/09/Indicadores_Economicos_9.13.2024.xlsx"
-        self.pull_file(url, file_path)
-
-
-    def pull_consumer(self, file_path: str):
-        session = requests.Session()
-        retry = Retry(
-            total=5,  # Number of retries
-            backoff_factor=1,  # Wait 1s, 2s, 4s, etc., between retries
-            status_forcelist=[500, 502, 503, 504],  # Retry on these status codes
-        )
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount("https://", adapter)
-    
+                print("\033[0;36mNOTICE: \033[0m" + f"File {file_path} already exists, skipping download")
+            return False
+
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:133.0) Gecko/20100101 Firefox/133.0',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
@@ -67,28 +183,4 @@ class DataPull:
         }
     
         # Perform the POST request to download the file
-        response = session.post(
-            'https://www.mercadolaboral.pr.gov/Tablas_Estadisticas/Otras_Tablas/T_Indice_Precio.aspx',
-            headers=headers,
-            data=data,
-            stream=True  # Stream the response to handle large files
-        )
-    
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Get the total file size from the headers
-            total_size = int(response.headers.get('content-length', 0))
-            # Open the file for writing in binary mode
-            with open(file_path, 'wb') as file:
-                # Use tqdm to show the download progress
-                for chunk in tqdm(response.iter_content(chunk_size=8192), 
-                                  total=total_size // 8192, 
-                                  unit='KB', 
-                                  desc='Downloading'):
-                    if chunk:  # Filter out keep-alive new chunks
-                        file.write(chunk)
-            if self.debug:
-                print(f"\033[0;32mSUCCESS: \033[0mDownloaded file to {file_path}")
-        else:
-            if self.debug:
-                print(f"\033[0;31mERROR: \033[0mFailed to download file. Status code: {response.status_code}")
+        return self.download(self.CONSUMER_URL, file_path, method="POST", headers=headers, data=data)
@@ -1,6 +1,29 @@
+import warnings
+
 import pandas as pd
 import numpy as np
 
+try:
+    from .metrics import stage
+    from .quantiles import PERCENTILES
+except ImportError:
+    from metrics import stage
+    from quantiles import PERCENTILES
+
+
+def life_expectancy(rates, width=5):
+    # Life expectancy at birth of an abridged life table along the last axis of rates (one
+    # mortality rate per age group). Age groups are width years wide, or a list of widths,
+    # deaths fall in the middle of the group and the last group is open
+    width = np.broadcast_to(np.asarray(width, dtype=float), rates.shape[-1:])[:-1]
+    closed = rates[..., :-1]
+    # Probability of dying within each closed group and the survivors at the start of every group
+    qx = np.minimum(width*closed/(1 + width/2*closed), 1)
+    lx = np.cumprod(np.concatenate([np.ones(rates.shape[:-1] + (1,)), 1 - qx], axis=-1), axis=-1)
+    # Years lived in each closed group and in the open group, per person born
+    years_lived = (width*(lx[..., :-1] + lx[..., 1:])/2).sum(axis=-1) + lx[..., -1]/rates[..., -1]
+    return years_lived
+
 
 class mortModel():
     def __init__(self, deaths, exposure):
@@ -11,78 +34,175 @@ class mortModel():
         self.death_rate = self.deaths.divide(self.exposure)
         # Create logged death rate matrix
         self.log_death_rate = np.log(self.death_rate)
-    
+        # Model constants, calculated once by fit()
+        self.ax = None
+        self.bx = None
+        self.kt = None
+        self.s1 = None
+
+    def fit(self):
+        if self.ax is None:
+            log_rates = self.log_death_rate.to_numpy()
+            # Average logged death rate of each age group (a_x) and the centered matrix it leaves
+            self.ax = log_rates.mean(axis=1)
+            self.centered = log_rates - self.ax[:, None]
+            # Only the first singular triplet is used: b_x, s1 and k_t
+            with stage("svd", model="lee_carter") as event:
+                U,S,V = np.linalg.svd(self.centered, full_matrices=False)
+                event.rows = self.centered.shape[0]
+            self.bx = U[:, 0]
+            self.s1 = S[0]
+            self.kt = V[0]
+        return self
+
     def mort_constants(self):
-        # Aggregate the logged death rates by age groups
-        log_aggregates = list(self.log_death_rate.T.sum())
-        averages = []
-        # Start loop in range of 0 to the length of the index (number of age groups) of the original logged death rates DataFrame
-        for i in range(0, self.log_death_rate.index.size):
-            # Calculate average logged death rate for age group i and append value to empty list
-            averages.append(float(log_aggregates[i] / len(self.log_death_rate.columns.values)))
-        return averages
+        return [float(value) for value in self.fit().ax]
         
 
     def centralized_matrix(self):
-        # Create empty matrix with the years from the logged death rates matrix as the index
-        centered_matrix = pd.DataFrame(index = self.log_death_rate.columns.values)
-        # Copy the logged death rates matrix, reset the index to turn the age groups to numbers, and transpose so the age groups are on top
-        logged_rates = self.log_death_rate.copy().reset_index(drop=True).T
-        for i in range(len(self.mort_constants())):
-            # Calculate the centralized death rate at age group i by subtracting the mortality constant of group i from the values of the column of age group i and add to matrix
-            centered_matrix[i] = pd.concat([pd.Series(logged_rates[i] - self.mort_constants()[i])], axis = 1)
-        # Return transposed matrix so years are on top again
-        return centered_matrix.T
+        # Centered logged death rates with the age groups numbered and the years on top
+        return pd.DataFrame(self.fit().centered, columns=self.log_death_rate.columns.values)
     
 
     def age_constants(self):
-        # Call the centralized matrix method and turn into numpy array to prepare for SVD
-        matrix = self.centralized_matrix().to_numpy()
-        # Perform SVD and declare the resulting values
-        U,S,V = np.linalg.svd(matrix)
-        # Create a dataframe from the relevant value
-        age_constant_list = pd.DataFrame(U)
-        # Turn the first column of values of the age constant matrix into a series and return it
-        age_constant_list = pd.Series(age_constant_list[0])
-        return age_constant_list
+        return pd.Series(self.fit().bx)
     
 
     def year_constants(self):
-        # Call the centralized matrix method and turn into numpy array to prepare for SVD
-        matrix = self.centralized_matrix().to_numpy()
-        # Perform SVD and declare the resulting values
-        U,S,V = np.linalg.svd(matrix)
-        # Create a dataframe from the relevant value
-        year_constants = pd.DataFrame(V)
-        # Turn the values of the first row into a series and return it
-        year_constants = pd.Series(year_constants.iloc[0])
-        return year_constants
+        return pd.Series(self.fit().kt)
     
 
     def scaling_eigenvalue(self):
-        # Call the centralized matrix method and turn into numpy array to prepare for SVD
-        matrix = self.centralized_matrix().to_numpy()
-        # Perform SVD and declare the resulting values
-        U,S,V = np.linalg.svd(matrix)
-        # Turn the array of scalars into a list and return the first one (the scaling eigenvalue)
-        vector = list(S)
-        return vector[0]
+        return self.fit().s1
     
 
     def mortality_rate(self, projected_constants):
-        # Create empty DataFrame
-        mortality = pd.DataFrame()
-        for i in range(0, len(projected_constants)):
-            # Create empty values list for use in loop
-            values_list = []
-            for j in range(0,16):
-                # Calculate mortality rate from formula (mx,t = ax + s1*bx*kt) and append result to empty list
-                values_list.append(np.exp(self.mort_constants()[j] + (self.scaling_eigenvalue()*self.age_constants()[j]*projected_constants[i])))
-                print(f"Age group {j} for year {i+int(self.death_rate.columns.values[0])} done")
-            # Add list of results to the mortality DataFrame
-            mortality[i+int(self.death_rate.columns.values[0])] = pd.concat([pd.Series(values_list)], axis=1)
-            print(f"Year {i+int(self.death_rate.columns.values[0])} done")
-        return mortality
+        self.fit()
+        projected_constants = np.asarray(projected_constants, dtype=float)
+        # Calculate every mortality rate at once from the formula (mx,t = exp(ax + s1*bx*kt))
+        mortality = np.exp(self.ax[:, None] + self.s1*np.outer(self.bx, projected_constants))
+        first_year = int(self.death_rate.columns.values[0])
+        return pd.DataFrame(mortality, columns=range(first_year, first_year + len(projected_constants)))
+
+    def mortality_tensor(self, kt_paths, chunk_size=10000):
+        # Mortality rates of simulated k_t paths, yields (simulations, years, age groups) arrays
+        # of at most chunk_size simulations so the whole tensor is never held in memory
+        self.fit()
+        kt_paths = np.asarray(kt_paths, dtype=float)
+        scale = self.s1*self.bx
+        for start in range(0, len(kt_paths), chunk_size):
+            yield np.exp(self.ax + kt_paths[start:start + chunk_size, :, None]*scale)
+
+    def fan_chart(self, kt_paths, levels=PERCENTILES, chunk_size=10000, width=5):
+        # Percentile bands of m_x,t and of life expectancy over the simulated k_t paths (the
+        # simulate_normal output). Returns the rates with one row per level and age group and
+        # the life expectancy with one row per level, both with one column per year.
+        self.fit()
+        if isinstance(kt_paths, pd.DataFrame):
+            years = [int(year) for year in kt_paths.columns]
+        else:
+            first_year = int(self.death_rate.columns.values[0])
+            years = range(first_year, first_year + np.shape(kt_paths)[1])
+        kt_paths = np.asarray(kt_paths, dtype=float)
+        levels = np.asarray(levels)
+
+        with stage("fan_chart", model="lee_carter", simulations=len(kt_paths)) as event:
+            # m_x,t is monotone in k_t for every age, so its order statistics are the rates of the
+            # k_t order statistics, reversed where b_x < 0. Interpolating between those matches
+            # np.quantile over the full tensor without building it
+            ordered = np.sort(kt_paths, axis=0)
+            rank = levels*(len(ordered) - 1)
+            low = np.floor(rank).astype(int)
+            fraction = (rank - low)[:, None, None]
+            high = np.minimum(low + 1, len(ordered) - 1)
+            falling = self.bx < 0
+            rates = []
+            for index in (low, high):
+                ascending = np.exp(self.ax + ordered[index][:, :, None]*(self.s1*self.bx))
+                descending = np.exp(self.ax + ordered[len(ordered) - 1 - index][:, :, None]*(self.s1*self.bx))
+                rates.append(np.where(falling, descending, ascending))
+            bands = rates[0] + fraction*(rates[1] - rates[0])
+
+            # Life expectancy depends on every age group at once, so it is computed chunk by chunk
+            e0 = np.empty(kt_paths.shape)
+            start = 0
+            for chunk in self.mortality_tensor(kt_paths, chunk_size):
+                e0[start:start + len(chunk)] = life_expectancy(chunk, width)
+                start += len(chunk)
+            event.rows = kt_paths.size*len(self.ax)
+
+        index = pd.MultiIndex.from_product([levels, self.death_rate.index], names=["level", "age_group"])
+        mortality = pd.DataFrame(bands.transpose(0, 2, 1).reshape(-1, len(years)), index=index, columns=years)
+        expectancy = pd.DataFrame(np.quantile(e0, levels, axis=0), index=pd.Index(levels, name="level"), columns=years)
+        return mortality, expectancy
+
+
+class mortBatch():
+    # Lee-Carter fit of many populations at once (sexes, regions, causes of death). deaths and
+    # exposure are lists of dataframes with the same age groups and years, or arrays of shape
+    # (populations, ages, years). Constants are arrays with one row per population.
+    def __init__(self, deaths, exposure, names=None, tol=1e-12, max_iter=1000, seed=0):
+        frames = isinstance(deaths[0], pd.DataFrame)
+        self.names = list(names) if names is not None else list(range(len(deaths)))
+        self.years = deaths[0].columns.values if frames else None
+        deaths = np.stack([np.asarray(d, dtype=float) for d in deaths])
+        exposure = np.stack([np.asarray(e, dtype=float) for e in exposure])
+        self.log_death_rate = np.log(deaths/exposure)
+        # Convergence of the power iteration and the seed of its random start
+        self.tol = tol
+        self.max_iter = max_iter
+        self.seed = seed
+        self.ax = None
+        self.bx = None
+        self.kt = None
+        self.s1 = None
+
+    def fit(self):
+        if self.ax is None:
+            self.ax = self.log_death_rate.mean(axis=2)
+            self.centered = self.log_death_rate - self.ax[:, :, None]
+            with stage("svd", model="lee_carter_batch", populations=len(self.names)) as event:
+                # Only the first singular triplet is needed, so instead of a full SVD of each
+                # population run a power iteration on the stacked ages x ages Gram matrices
+                gram = self.centered @ self.centered.transpose(0, 2, 1)
+                v = np.random.default_rng(self.seed).standard_normal(gram.shape[:2])
+                v /= np.linalg.norm(v, axis=1, keepdims=True)
+                for _ in range(self.max_iter):
+                    w = np.einsum("pij,pj->pi", gram, v)
+                    w /= np.linalg.norm(w, axis=1, keepdims=True)
+                    done = np.abs(w - v).max() < self.tol
+                    v = w
+                    if done:
+                        break
+                else:
+                    warnings.warn(f"Power iteration did not converge to tol={self.tol} in {self.max_iter} iterations")
+                event.rows = self.centered.shape[0]*self.centered.shape[1]
+            # Singular vectors are defined up to sign, pick the one where b_x adds up positive
+            v *= np.where(v.sum(axis=1, keepdims=True) < 0, -1.0, 1.0)
+            projected = np.einsum("pay,pa->py", self.centered, v)
+            self.bx = v
+            self.s1 = np.linalg.norm(projected, axis=1)
+            self.kt = projected/self.s1[:, None]
+        return self
+
+    def constants(self):
+        # a_x, b_x and k_t of every population, one row per population and age group or year
+        self.fit()
+        ages = range(self.ax.shape[1])
+        return (
+            pd.DataFrame(self.ax, index=self.names, columns=ages),
+            pd.DataFrame(self.bx, index=self.names, columns=ages),
+            pd.DataFrame(self.kt, index=self.names, columns=self.years),
+        )
+
+    def scaling_eigenvalues(self):
+        return pd.Series(self.fit().s1, index=self.names)
+
+    def mortality_rate(self, projected_constants):
+        # projected_constants has one row of k_t per population, returns (populations, ages, years)
+        self.fit()
+        projected_constants = np.asarray(projected_constants, dtype=float)
+        return np.exp(self.ax[:, :, None] + (self.s1[:, None]*self.bx)[:, :, None]*projected_constants[:, None, :])
 
 
 def main():
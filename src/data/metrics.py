@@ -0,0 +1,208 @@
+from datetime import datetime, timezone
+import tracemalloc
+import threading
+import json
+import time
+import os
+
+class Event:
+    """
+    Measurements of one run of a pipeline stage. Code inside the stage can set
+    `rows` and `bytes` and add labels, the rest is filled in when the stage ends.
+    """
+    __slots__ = ("stage", "labels", "rows", "bytes", "seconds", "peak_memory", "timestamp")
+
+    def __init__(self, stage:str, labels:dict):
+        self.stage = stage
+        self.labels = labels
+        self.rows = None
+        self.bytes = None
+        self.seconds = None
+        self.peak_memory = None
+        self.timestamp = None
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "stage": self.stage,
+            "seconds": self.seconds,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "peak_memory": self.peak_memory,
+            **self.labels,
+        }
+
+
+class JsonLogSink:
+    """
+    Appends every event as one JSON object per line.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the log file
+    """
+    def __init__(self, file_path:str):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+
+    def emit(self, event:Event) -> None:
+        line = json.dumps(event.to_dict(), default=str)
+        with self.lock, open(self.file_path, "a") as file:
+            file.write(line + "\n")
+
+
+class PrometheusSink:
+    """
+    Keeps per-stage totals and rewrites them to a file in the Prometheus text
+    exposition format, e.g. for the node exporter textfile collector.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the metrics file
+    prefix : str
+        Prefix of the metric names. Defaults to 'jp_index'.
+    """
+    def __init__(self, file_path:str, prefix:str="jp_index"):
+        self.file_path = file_path
+        self.prefix = prefix
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def emit(self, event:Event) -> None:
+        with self.lock:
+            totals = self.totals.setdefault(event.stage, {"runs": 0, "seconds": 0.0, "rows": 0, "bytes": 0, "peak_memory": 0})
+            totals["runs"] += 1
+            totals["seconds"] += event.seconds
+            totals["rows"] += event.rows or 0
+            totals["bytes"] += event.bytes or 0
+            totals["peak_memory"] = max(totals["peak_memory"], event.peak_memory or 0)
+            self.write()
+
+    def write(self) -> None:
+        metrics = [
+            ("stage_runs_total", "counter", "Number of runs of the stage", "runs"),
+            ("stage_seconds_total", "counter", "Wall time spent in the stage", "seconds"),
+            ("stage_rows_total", "counter", "Rows handled by the stage", "rows"),
+            ("stage_bytes_total", "counter", "Bytes handled by the stage", "bytes"),
+            ("stage_peak_memory_bytes", "gauge", "Largest peak of traced memory in the stage", "peak_memory"),
+        ]
+        lines = []
+        for name, kind, description, key in metrics:
+            lines.append(f"# HELP {self.prefix}_{name} {description}")
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+            for stage, totals in sorted(self.totals.items()):
+                lines.append(f'{self.prefix}_{name}{{stage="{stage}"}} {totals[key]}')
+        with open(f"{self.file_path}.tmp", "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(f"{self.file_path}.tmp", self.file_path)
+
+
+SINKS = []
+TRACK_MEMORY = False
+LOCAL = threading.local()
+
+
+def configure(*sinks, track_memory:bool=False) -> None:
+    """
+    Enables the instrumentation and sends the events to the given sinks. Without
+    sinks the stages are not timed at all.
+
+    Parameters
+    ----------
+    sinks : JsonLogSink | PrometheusSink
+        Objects with an `emit(event)` method
+    track_memory : bool
+        Whether to measure the peak memory of each stage with tracemalloc. This
+        slows down Python-heavy stages. Defaults to False.
+    """
+    global TRACK_MEMORY
+    SINKS[:] = sinks
+    TRACK_MEMORY = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable() -> None:
+    """
+    Disables the instrumentation.
+    """
+    configure()
+
+
+class stage:
+    """
+    Context manager that measures one stage of the pipeline, e.g.
+
+        with stage("sheet_parse", sheet=3) as event:
+            df = ...
+            event.rows = len(df)
+
+    Peak memory is the largest amount of memory traced by tracemalloc during the
+    stage, above what was in use when it started, so it only covers Python and
+    numpy allocations and is approximate when stages run in several threads.
+    """
+    __slots__ = ("event", "start", "memory")
+
+    def __init__(self, name:str, **labels):
+        self.event = Event(name, labels) if SINKS else None
+
+    def __enter__(self) -> Event:
+        if self.event is None:
+            return Event(None, {})
+        if TRACK_MEMORY:
+            stack = LOCAL.__dict__.setdefault("stack", [])
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].memory[1] = max(stack[-1].memory[1], peak)
+            tracemalloc.reset_peak()
+            self.memory = [current, current]
+            stack.append(self)
+        self.start = time.perf_counter()
+        return self.event
+
+    def __exit__(self, *exc) -> None:
+        if self.event is None:
+            return
+        self.finish()
+        emit(self.event)
+
+    def finish(self) -> None:
+        self.event.seconds = time.perf_counter() - self.start
+        self.event.timestamp = datetime.now(timezone.utc).isoformat()
+        if TRACK_MEMORY:
+            LOCAL.stack.pop()
+            peak = max(self.memory[1], tracemalloc.get_traced_memory()[1])
+            self.event.peak_memory = peak - self.memory[0]
+            if LOCAL.stack:
+                LOCAL.stack[-1].memory[1] = max(LOCAL.stack[-1].memory[1], peak)
+
+
+class measure(stage):
+    """
+    Measures a stage like `stage` but keeps the event instead of sending it to
+    the sinks. Meant for stages that run in worker processes, where the sinks
+    are copies of the parent's (fork) or empty (spawn): the worker returns the
+    event and the parent passes it to `emit`.
+    """
+    __slots__ = ()
+
+    def __init__(self, name:str, **labels):
+        self.event = Event(name, labels)
+
+    def __exit__(self, *exc) -> None:
+        self.finish()
+
+
+def emit(event:Event) -> None:
+    """
+    Sends a finished event to the sinks, e.g. one measured in a worker process.
+
+    Parameters
+    ----------
+    event : Event
+        The event to send
+    """
+    for sink in SINKS:
+        sink.emit(event)
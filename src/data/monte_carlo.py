@@ -1,38 +1,246 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import numpy as np
+import os
 import pandas as pd
-from scipy.stats import truncnorm
+from scipy.stats import truncnorm, qmc
+import warnings
 from tqdm import tqdm
 
+try:
+    from .metrics import stage
+    from .quantiles import PERCENTILES
+except ImportError:
+    from metrics import stage
+    from quantiles import PERCENTILES
+
+# Ways of drawing the simulations: independent pseudo-random draws, antithetic pairs of
+# uniforms (u, 1 - u) and scrambled Sobol points, the last two through the inverse CDF
+SAMPLING = ("random", "antithetic", "sobol")
+
+class QuantileSketch():
+    # Streaming quantile summary of bounded draws, one per column. Draws are counted in a
+    # fixed grid of bins between the truncation bounds, so sketches of different chunks
+    # or workers merge exactly by adding their counts. Quantiles are interpolated
+    # within a bin, the error is at most (upper - lower)/bins.
+    def __init__(self, columns, lower, upper, bins=2**16):
+        self.lower = float(lower)
+        self.upper = float(upper)
+        self.bins = bins
+        self.counts = np.zeros((columns, bins), dtype=np.int64)
+
+    def update(self, chunk):
+        # chunk is a (simulations, columns) array of draws
+        width = (self.upper - self.lower)/self.bins
+        index = np.clip(((chunk - self.lower)/width).astype(np.int64), 0, self.bins - 1)
+        index += np.arange(self.counts.shape[0])*self.bins
+        self.counts += np.bincount(index.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    def count(self):
+        return int(self.counts[0].sum())
+
+    def quantiles(self, levels=PERCENTILES):
+        # Same definition as numpy's default: the value at rank q*(n - 1) of the sorted draws
+        cumulative = np.cumsum(self.counts, axis=1)
+        width = (self.upper - self.lower)/self.bins
+        result = np.empty((self.counts.shape[0], len(levels)))
+        for column in range(self.counts.shape[0]):
+            ranks = np.asarray(levels)*(cumulative[column, -1] - 1)
+            # Place the draws of each rank evenly inside their bin and interpolate between ranks
+            values = []
+            for rank in (np.floor(ranks), np.ceil(ranks)):
+                index = np.searchsorted(cumulative[column], rank, side="right")
+                below = np.where(index > 0, cumulative[column, index - 1], 0)
+                values.append(self.lower + (index + (rank - below + 0.5)/self.counts[column, index])*width)
+            result[column] = values[0] + (ranks - np.floor(ranks))*(values[1] - values[0])
+        return result
+
+def simulate_shards(task):
+    # Runs in a worker process: draws a group of shards of one series, each from its own
+    # seed, and returns their merged sketch so no draws are sent back to the parent
+    year_constants, upper, lower, std_dev, shards, bins, chunk_size, sampling = task
+    sketch = QuantileSketch(len(year_constants), lower, upper, bins)
+    for seed, size in shards:
+        mc = monteCarlo(size, seed=seed, chunk_size=chunk_size, progress=False, sampling=sampling)
+        for chunk in mc.draw_chunks(year_constants, upper, lower, std_dev):
+            sketch.update(chunk)
+    return sketch
+
 class monteCarlo():
-    def __init__(self, simulation_count):
+    def __init__(self, simulation_count, seed=None, chunk_size=10000, progress=True, sampling="random"):
+        if sampling not in SAMPLING:
+            raise Exception("Sampling is not supported")
         self.simulation_count = simulation_count
+        self.sampling = sampling
+        # Simulations drawn at once, bounds the memory used by each batch of draws
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed)
+        # Percentiles of every scenario already evaluated by scenario_grid
+        self.scenario_cache = {}
+
+    def draw_uniforms(self, dimensions):
+        # Uniforms behind the inverse CDF draws, in chunks of chunk_size simulations
+        if self.sampling == "sobol":
+            # One dimension per year, chunks continue the same scrambled sequence
+            sobol = qmc.Sobol(dimensions, scramble=True, seed=self.rng)
+        for start in tqdm(range(0, self.simulation_count, self.chunk_size), disable=not self.progress):
+            size = (min(self.chunk_size, self.simulation_count - start), dimensions)
+            if self.sampling == "antithetic":
+                # Every uniform is paired with its mirror in the same chunk
+                u = self.rng.random(((size[0] + 1)//2, size[1]))
+                yield np.concatenate([u, 1 - u])[:size[0]]
+            elif self.sampling == "sobol":
+                # Sobol balance is best for power of two counts, chunks of any size are allowed
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", UserWarning)
+                    yield sobol.random(size[0])
+            else:
+                yield self.rng.random(size)
+
+    def draw_chunks(self, year_constants, upper, lower, std_dev):
+        # Broadcast the truncation bounds of every year so a whole chunk of simulations is drawn in one call
+        loc = np.asarray(year_constants, dtype=float)
+        a = (lower - loc)/std_dev
+        b = (upper - loc)/std_dev
+        if self.sampling != "random":
+            for u in self.draw_uniforms(loc.size):
+                yield truncnorm.ppf(u, a, b, loc=loc, scale=std_dev)
+            return
+        for start in tqdm(range(0, self.simulation_count, self.chunk_size), disable=not self.progress):
+            size = (min(self.chunk_size, self.simulation_count - start), loc.size)
+            yield truncnorm.rvs(a, b, loc=loc, scale=std_dev, size=size, random_state=self.rng)
 
     def simulate_normal(self, years, year_constants, upper, lower, std_dev):
-        sim_values = pd.DataFrame()
-        years = pd.Series(years)
-        counter = 0
-        for i in year_constants:
-            values_list = []
-            for _ in tqdm(range(self.simulation_count)):
-                sim_num = truncnorm.rvs((lower - i)/std_dev, (upper - i)/std_dev, loc=i, scale=std_dev, size=1)
-                values_list.append(sim_num.item())
-            sim_values[f"{years[counter]}"] = pd.Series(values_list)
-            print(f"Year {years[counter]} done")
-            counter += 1
-        return sim_values
+        sim_values = np.empty((self.simulation_count, len(year_constants)))
+        start = 0
+        with stage("simulation", years=len(year_constants)) as event:
+            for chunk in self.draw_chunks(year_constants, upper, lower, std_dev):
+                sim_values[start:start + len(chunk)] = chunk
+                start += len(chunk)
+            event.rows = start
+            event.bytes = sim_values.nbytes
+        return pd.DataFrame(sim_values, columns=[f"{year}" for year in years])
     
-    def percentiles(self, sim_results):
-        all_percentiles = pd.DataFrame()
-        for column in sim_results:
-            perc_1 = float(sim_results[f"{column}"].quantile(0.005))
-            perc_3 = float(sim_results[f"{column}"].quantile(0.025))
-            perc_5 = float(sim_results[f"{column}"].quantile(0.05))
-            perc_50 = float(sim_results[f"{column}"].quantile(0.5))
-            perc_95 = float(sim_results[f"{column}"].quantile(0.95))
-            perc_97 = float(sim_results[f"{column}"].quantile(0.975))
-            perc_99 = float(sim_results[f"{column}"].quantile(0.995))
-            percentiles = pd.Series([perc_1, perc_3, perc_5, perc_50, perc_95, perc_97, perc_99])
-            all_percentiles[f"{column}"] = percentiles
-        return all_percentiles.T
+    def percentiles(self, sim_results, levels=PERCENTILES):
+        # Every level of every year in one call, one row per year and one column per level
+        values = np.quantile(sim_results.to_numpy(), levels, axis=0)
+        return pd.DataFrame(values.T, index=sim_results.columns)
+
+    def simulate_sketch(self, year_constants, upper, lower, std_dev, bins=2**16):
+        # Summarizes the draws chunk by chunk without keeping them, memory does not grow with simulation_count
+        sketch = QuantileSketch(len(year_constants), lower, upper, bins)
+        with stage("simulation", years=len(year_constants)) as event:
+            for chunk in self.draw_chunks(year_constants, upper, lower, std_dev):
+                sketch.update(chunk)
+            event.rows = sketch.count()
+            event.bytes = sketch.counts.nbytes
+        return sketch
+
+    def streaming_percentiles(self, years, year_constants, upper, lower, std_dev, levels=PERCENTILES, bins=2**16):
+        # Same table as percentiles(simulate_normal(...)), estimated from a QuantileSketch
+        sketch = self.simulate_sketch(year_constants, upper, lower, std_dev, bins)
+        return pd.DataFrame(sketch.quantiles(levels), index=[f"{year}" for year in years])
+
+    def simulate_parallel(self, series, workers=None, shard_size=100000, levels=PERCENTILES, bins=2**16):
+        # Runs simulation_count simulations of every series in a process pool. series maps a
+        # name to a dict with years, year_constants, upper, lower and std_dev. The simulations
+        # are split in shards of shard_size, shard i of series k always draws from the seed
+        # (seed, k, i) and the integer sketches add up in any order, so the result does not
+        # depend on the number of workers. Returns the percentiles of each series.
+        workers = workers or os.cpu_count()
+        sizes = [min(shard_size, self.simulation_count - start) for start in range(0, self.simulation_count, shard_size)]
+        tasks = []
+        for k, params in enumerate(series.values()):
+            shards = [(np.random.SeedSequence(self.seed.entropy, spawn_key=(k, i)), size) for i, size in enumerate(sizes)]
+            for group in range(min(workers, len(shards))):
+                tasks.append((k, (params["year_constants"], params["upper"], params["lower"], params["std_dev"], shards[group::workers], bins, self.chunk_size, self.sampling)))
+
+        sketches = {}
+        with stage("simulation", series=len(series), workers=workers) as event:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(simulate_shards, [task for _, task in tasks])
+                for (k, _), sketch in tqdm(zip(tasks, results), total=len(tasks), disable=not self.progress):
+                    sketches[k] = sketches[k].merge(sketch) if k in sketches else sketch
+            event.rows = self.simulation_count*len(series)
+
+        return {
+            name: pd.DataFrame(sketches[k].quantiles(levels), index=[f"{year}" for year in params["years"]])
+            for k, (name, params) in enumerate(series.items())
+        }
+
+    def convergence_report(self, year_constants, upper, lower, std_dev, counts=(1024, 4096, 16384), replications=20, sampling=SAMPLING, levels=PERCENTILES):
+        # Standard error of the percentiles against the number of simulations for each sampling
+        # mode, estimated from independent replications and averaged over the years. Returns
+        # one row per sampling mode, simulation count and level.
+        rows = []
+        seeds = self.seed.spawn(replications)
+        for mode in sampling:
+            for count in counts:
+                estimates = []
+                for seed in seeds:
+                    mc = monteCarlo(count, seed=seed, chunk_size=self.chunk_size, progress=False, sampling=mode)
+                    draws = np.concatenate(list(mc.draw_chunks(year_constants, upper, lower, std_dev)))
+                    estimates.append(np.quantile(draws, levels, axis=0))
+                std_error = np.std(estimates, axis=0, ddof=1).mean(axis=1)
+                rows += [{"sampling": mode, "simulations": count, "level": level, "std_error": error} for level, error in zip(levels, std_error)]
+        return pd.DataFrame(rows)
+
+    def scenario_grid(self, years, year_constants, upper, lower, std_dev, levels=PERCENTILES):
+        # Percentiles of every combination of the upper, lower and std_dev values. All scenarios
+        # share the same uniforms (common random numbers), so they differ only by their
+        # parameters. The inverse CDF is increasing, so the percentiles of a scenario are the
+        # inverse CDF of the uniform order statistics: the uniforms are drawn and sorted once
+        # and every scenario is evaluated from them in one broadcast call. Scenarios are cached
+        # by their parameters and the seed. Returns one row per scenario, year and level.
+        loc = np.asarray(year_constants, dtype=float)
+        levels = tuple(float(level) for level in levels)
+        scenarios = list(product(*(np.atleast_1d(np.asarray(values, dtype=float)).tolist() for values in (upper, lower, std_dev))))
+        if any(sd <= 0 or lo >= up for up, lo, sd in scenarios):
+            raise Exception("Scenario parameters are not valid")
+        context = (self.seed.entropy, self.seed.spawn_key, self.sampling, self.simulation_count, loc.tobytes(), levels)
+        missing = [scenario for scenario in scenarios if (scenario, context) not in self.scenario_cache]
+
+        if missing:
+            with stage("scenario_grid", scenarios=len(missing), years=loc.size) as event:
+                # Fresh generator so the uniforms only depend on the seed, not on earlier draws
+                mc = monteCarlo(self.simulation_count, seed=self.seed, chunk_size=self.chunk_size, progress=False, sampling=self.sampling)
+                ordered = np.sort(np.concatenate(list(mc.draw_uniforms(loc.size))), axis=0)
+                # Same interpolation between order statistics as np.quantile
+                rank = np.asarray(levels)*(len(ordered) - 1)
+                low = np.floor(rank).astype(int)
+                high = np.minimum(low + 1, len(ordered) - 1)
+                fraction = (rank - low)[None, :, None]
+                up, lo, sd = (np.array(values)[:, None, None] for values in zip(*missing))
+                a = (lo - loc)/sd
+                b = (up - loc)/sd
+                # (scenarios, levels, years)
+                low_values = truncnorm.ppf(ordered[low][None], a, b, loc=loc, scale=sd)
+                high_values = truncnorm.ppf(ordered[high][None], a, b, loc=loc, scale=sd)
+                values = low_values + fraction*(high_values - low_values)
+                event.rows = self.simulation_count*loc.size
+            for scenario, value in zip(missing, values):
+                self.scenario_cache[(scenario, context)] = value
+
+        values = np.stack([self.scenario_cache[(scenario, context)] for scenario in scenarios])
+        params = np.array(scenarios)
+        shape = (len(scenarios), len(levels), loc.size)
+        index = np.indices(shape).reshape(3, -1)
+        return pd.DataFrame({
+            "scenario": index[0],
+            "upper": params[index[0], 0],
+            "lower": params[index[0], 1],
+            "std_dev": params[index[0], 2],
+            "year": np.asarray([f"{year}" for year in years])[index[2]],
+            "level": np.asarray(levels)[index[1]],
+            "value": values.ravel(),
+        })
 
 def main():
     # Male year constants simulation
@@ -46,8 +254,15 @@ def main():
 
     year_constants_p = pd.read_csv("kt_p.csv")
     mc = monteCarlo(100000)
-    mc.percentiles(mc.simulate_normal(year_constants_p["year"], year_constants_p["kt_m_p"], upper_normal_m, lower_normal_m, std_dev_m)).to_csv("kt_sim_m.csv")
-    mc.percentiles(mc.simulate_normal(year_constants_p["year"], year_constants_p["kt_f_p"], upper_normal_f, lower_normal_f, std_dev_f)).to_csv("kt_sim_f.csv")
+    # Male and female series are simulated in one job across every core
+    results = mc.simulate_parallel({
+        "m": {"years": year_constants_p["year"], "year_constants": year_constants_p["kt_m_p"].to_numpy(),
+              "upper": upper_normal_m, "lower": lower_normal_m, "std_dev": std_dev_m},
+        "f": {"years": year_constants_p["year"], "year_constants": year_constants_p["kt_f_p"].to_numpy(),
+              "upper": upper_normal_f, "lower": lower_normal_f, "std_dev": std_dev_f},
+    })
+    results["m"].to_csv("kt_sim_m.csv")
+    results["f"].to_csv("kt_sim_f.csv")
     
 
 if __name__ == "__main__":
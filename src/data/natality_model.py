@@ -2,47 +2,62 @@ import pandas as pd
 import numpy as np
 from scipy import linalg
 
+try:
+    from .metrics import stage
+except ImportError:
+    from metrics import stage
+
 
 class natModel():
     def __init__(self, tfr):
         # Declare given dataframes
         self.tfr = tfr
+        # Decomposition, calculated once by fit()
+        self.averages = None
+        self.w = None
+        self.v = None
+
+    def fit(self):
+        if self.averages is None:
+            tfr = self.tfr.to_numpy(dtype=float)
+            # Average tfr of each age group and the centered matrix it leaves
+            self.averages = tfr.mean(axis=0)
+            self.centered = tfr - self.averages
+            self.covar = self.centered.T @ self.centered
+            with stage("eigen", model="natality") as event:
+                self.w, self.v = linalg.eigh(self.covar)
+                event.rows = self.covar.shape[0]
+        return self
     
     def nat_constants(self):
-        # Aggregate the tfr by age groups
-        aggregates = list(self.tfr.sum())
-        averages = []
-        # Start loop in range of 0 to the length of the index (number of age groups) of the original tfr DataFrame
-        for i in range(0, len(self.tfr.columns.values)):
-            # Calculate average tfr for age group i and append value to empty list
-            averages.append(float(aggregates[i] / self.tfr.index.size))
-        return averages
+        return [float(value) for value in self.fit().averages]
    
 
     def centralized_frame(self):
-        # Create empty matrix with the years from the logged death rates matrix as the index
-        centered_matrix = pd.DataFrame(index = self.tfr.index)
-        tfr_t = self.tfr.copy().T.reset_index(drop=True).T
-        for i in range(len(self.nat_constants())):
-            # Calculate the centralized death rate at age group i by subtracting the mortality constant of group i from the values of the column of age group i and add to matrix
-            centered_matrix[i] = pd.concat([pd.Series(tfr_t[i] - self.nat_constants()[i])], axis=1)
-        return centered_matrix
+        return pd.DataFrame(self.fit().centered, index=self.tfr.index)
 
     def nat_covar(self):
-        cent_matrix = self.centralized_frame().to_numpy()
-        cent_matrix_T = self.centralized_frame().T.to_numpy()
-        covar_matrix = np.matmul(cent_matrix_T, cent_matrix)
-        return covar_matrix
+        return self.fit().covar
     
     def eigenvals(self):
-        covar_matrix = self.nat_covar()
-        w, v = linalg.eigh(covar_matrix)
-        return pd.Series(w)
+        return pd.Series(self.fit().w)
     
     def eigenvect(self):
-        covar_matrix = self.nat_covar()
-        w, v = linalg.eigh(covar_matrix)
-        return pd.DataFrame(v)
+        return pd.DataFrame(self.fit().v)
+
+    def explained_variance(self):
+        # Share of the total variance explained by each eigenvalue, in the same order as eigenvals()
+        return pd.Series(self.fit().w / self.w.sum())
+
+
+def batch_eigen(tfr_panels):
+    # Stack the panels (e.g. regions or scenarios) into a (panels, years, age groups) array
+    tfr = np.stack([np.asarray(panel, dtype=float) for panel in tfr_panels])
+    centered = tfr - tfr.mean(axis=1, keepdims=True)
+    covar = np.matmul(centered.transpose(0, 2, 1), centered)
+    # Decompose every covariance matrix in one batched call
+    w, v = np.linalg.eigh(covar)
+    return w, v, w / w.sum(axis=1, keepdims=True)
 
 
 def main():
@@ -1,8 +1,12 @@
 import time
 
-import pandas as pd
 import requests
 
+try:
+    from .awards_pull import PageSink
+except ImportError:
+    from awards_pull import PageSink
+
 # API configuration
 URL = "https://api.usaspending.gov/api/v2/search/spending_by_award/"
 HEADERS = {"Content-Type": "application/json"}
@@ -63,12 +67,17 @@ def make_request(url: str, payload: dict, retries: int = 5) -> dict:
 
 def get_data() -> None:
     """
-    Download paginated data from the API and store it in a CSV file.
+    Download paginated data from the API and store it in a CSV file. Pages are
+    spooled to disk as they arrive, an interrupted download resumes where it
+    stopped.
     """
-    all_data = []  # Initialize an empty list to store all results
+    sink = PageSink("prime_award_results.csv")  # Writes each page to disk
     page = 1  # Start from the first page
 
     while True:
+        if page in sink.pages:  # Already downloaded before an interruption
+            page += 1
+            continue
         print(f"Downloading page {page}...")
         PAYLOAD["page"] = page  # Update the current page in the payload
 
@@ -80,25 +89,22 @@ def get_data() -> None:
         data = response.get("results", [])  # Extract results from the response
         if not data:
             print("No more data available.")
+            sink.finish()  # Every page has been downloaded
             break
 
-        all_data.extend(data)  # Append the data from the current page
+        sink.write(page, data)  # Append the data from the current page
         page += 1  # Move to the next page
 
-    save_to_csv(all_data)  # Save the collected data to a CSV file
-
-
-def save_to_csv(data: list) -> None:
-    """
-    Save the collected data into a CSV file.
+    if not sink.complete:  # Keep the spool so a rerun resumes the download
+        sink.close()
+        print(f"Error: Download is incomplete, {len(sink.pages)} pages kept in {sink.spool_file}.")
+        return
 
-    Args:
-        data (list): List of dictionaries representing the API results.
-    """
-    df = pd.DataFrame(data)  # Convert the data into a DataFrame
-    output_file = "prime_award_results.csv"  # Define the output file name
-    df.to_csv(output_file, index=False)  # Save the DataFrame to CSV
-    print(f"Data saved to {output_file}")
+    rows = sink.compact()  # Save the collected data to a CSV file
+    if rows:
+        print(f"Data saved to {sink.output_file}")
+    else:
+        print("Error: No data was received, nothing was saved.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,3 @@
+# Quantile levels of the simulation summaries and fan charts: the 99%, 95% and 90% bands
+# and the median
+PERCENTILES = (0.005, 0.025, 0.05, 0.5, 0.95, 0.975, 0.995)